@@ -0,0 +1,639 @@
+#!/usr/bin/python3
+
+# Benchmarks for the hot paths of naziFinder.py
+# Usage:    benchmark.py [megachunkSize] [repeats]
+#           benchmark.py pipeline [paintedShare] [plants] [workers]
+#           benchmark.py watch [polls] [changesPerPoll]
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import datetime
+import sqlite3
+import asyncio
+import tempfile
+import threading
+import subprocess
+import resource
+import cv2
+import numpy as np
+import PIL.Image
+from aiohttp import web
+
+import naziFinder
+
+# The original convert_to_indexed (one full-image comparison per palette entry), kept as the baseline
+def legacy_convert_to_indexed(image, lut):
+    H, W, _ = image.shape
+    indexed_image = np.zeros((H, W), dtype=np.uint8)
+    for color_tuple, index in lut.items():
+        mask = np.all(image == color_tuple, axis=-1)
+        indexed_image[mask] = index
+    return indexed_image
+
+# The original per-color matching loop of image_processing (inRange + TM_CCOEFF_NORMED == 1), kept as the baseline.
+# Returns the matches as (color, templateNumber, y, x) in the order it used to write them
+def legacy_match(canvasImage, templates, lut):
+    detections = []
+    for currentColor in range(len(lut)):
+        canvasImage_BW = cv2.inRange(canvasImage, currentColor, currentColor)
+        for templateNumber, template in enumerate(templates):
+            template = legacy_convert_to_indexed(template, lut)
+            if template.shape[0] < canvasImage.shape[0] and template.shape[1] < canvasImage.shape[1]:
+                matchTemplateResult = cv2.matchTemplate(canvasImage_BW, template, cv2.TM_CCOEFF_NORMED)
+                locations = np.where(matchTemplateResult >= 1)
+                detections.extend((currentColor, templateNumber, int(y), int(x)) for y, x in zip(*locations))
+    return detections
+
+# The exact matcher of image_processing, returning the same (color, templateNumber, y, x) list
+def exact_match(canvasImage, compiledTemplates):
+    detections = []
+    for templateNumber, template in enumerate(compiledTemplates):
+        if template.foreground.shape[0] < canvasImage.shape[0] and template.foreground.shape[1] < canvasImage.shape[1]:
+            xs, ys, colors = naziFinder.match_template_exact(canvasImage, template)
+            detections.extend(zip(colors.tolist(), [templateNumber] * len(colors), ys.tolist(), xs.tolist()))
+    detections.sort()
+    return detections
+
+# Loads every template image in ./templates (including the IGNORE_ ones, they make a wider corpus)
+def load_template_images(directory='./templates'):
+    rePattern = re.compile(r'.*\.(png|jpe?g)', re.IGNORECASE)
+    templates = []
+    for filename in sorted(os.listdir(directory)):
+        if rePattern.fullmatch(filename):
+            template = cv2.imread(os.path.join(directory, filename))
+            if template is not None:
+                templates.append(template)
+    return templates
+
+# The template images of load_template_images and the templates compiled from them (named by their number)
+def load_compiled_templates(directory='./templates'):
+    templates = load_template_images(directory)
+    return templates, [naziFinder.compile_template(str(number), cv2.cvtColor(template, cv2.COLOR_BGR2GRAY) < 128) for number, template in enumerate(templates)]
+
+# Runs func repeats times and returns the best time in seconds
+def best_time(func, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        timer_start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - timer_start)
+    return best
+
+# Random BGR megachunk made only of palette colors
+def random_megachunk(size, seed=0):
+    rng = np.random.default_rng(seed)
+    palette_BGR = np.array([color[::-1] for color in naziFinder.SEARCHABLE_COLORS_RGB], dtype=np.uint8)
+    return palette_BGR[rng.integers(0, len(palette_BGR), size=(size, size))]
+
+# Indexed megachunk that looks like a canvas: large single-color areas, some noise,
+# and templates planted in random colors. Every other planted template gets one griefed pixel.
+# A `blank` share of the 64x64 areas is left as untouched background (no noise)
+def synthetic_megachunk(size, templates, seed=0, plants=200, blank=0.0):
+    rng = np.random.default_rng(seed)
+    colorCount = len(naziFinder.SEARCHABLE_COLORS_RGB)
+    blocks = rng.integers(0, colorCount, size=(size // 64 + 1, size // 64 + 1)).astype(np.uint8)
+    blankBlocks = rng.random(blocks.shape) < blank
+    blocks[blankBlocks] = 0
+    canvasImage = np.kron(blocks, np.ones((64, 64), dtype=np.uint8))[:size, :size].copy()
+    noise = rng.random((size, size)) < 0.02
+    noise &= ~np.kron(blankBlocks, np.ones((64, 64), dtype=bool))[:size, :size]
+    canvasImage[noise] = rng.integers(0, colorCount, size=np.count_nonzero(noise))
+    for plant in range(plants):
+        template = templates[rng.integers(len(templates))]
+        foreground = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY) < 128
+        th, tw = foreground.shape
+        y, x = rng.integers(0, size - th), rng.integers(0, size - tw)
+        window = canvasImage[y:y + th, x:x + tw]
+        color = rng.integers(colorCount)
+        window[window == color] = (color + 1) % colorCount
+        window[foreground] = color
+        if plant % 2:
+            window[rng.integers(th), rng.integers(tw)] = (color + 2) % colorCount
+    return canvasImage
+
+def bench_matching(size, repeats, corpus=4):
+    lut = naziFinder.SEARCHABLE_LUT
+    templates, compiledTemplates = load_compiled_templates()
+
+    # Regression corpus: every match of the old loop has to be found, and every match found has to have a
+    # correlation of 1 (computed in float64). The old loop loses some exact matches to float32 rounding
+    # (TM_CCOEFF_NORMED comes out as 0.9999998), those are reported as recovered
+    recovered = 0
+    for seed in range(corpus):
+        canvasImage = synthetic_megachunk(min(size, 512), templates, seed)
+        legacy = legacy_match(canvasImage, templates, lut)
+        detections = exact_match(canvasImage, compiledTemplates)
+        if not set(legacy) <= set(detections):
+            raise AssertionError(f"match_template_exact misses matches of the legacy loop on corpus megachunk #{seed}")
+        for currentColor, templateNumber, y, x in detections:
+            template = legacy_convert_to_indexed(templates[templateNumber], lut)
+            th, tw = template.shape
+            window = canvasImage[y:y + th, x:x + tw] == currentColor
+            if np.corrcoef(window.ravel(), template.ravel())[0, 1] < 1 - 1e-9:
+                raise AssertionError(f"match_template_exact found a false match on corpus megachunk #{seed} at ({x}, {y})")
+        recovered += len(detections) - len(legacy)
+    print(f"match_template_exact agrees with the legacy loop on {corpus} corpus megachunks ({recovered} matches lost to rounding recovered)")
+
+    canvasImage = synthetic_megachunk(size, templates)
+    legacy_time = best_time(lambda: legacy_match(canvasImage, templates, lut), 1)
+    new_time = best_time(lambda: exact_match(canvasImage, compiledTemplates), repeats)
+    print(f"matching {len(templates)} templates on {size}x{size}: legacy {legacy_time:.2f} s, exact {new_time*1000:.1f} ms ({legacy_time/new_time:.1f}x)")
+
+# The tiling planner must cover every position of a region exactly once: scanning the cores of the planned units
+# (with their halos) has to give the same matches as scanning the whole region, without duplicates.
+# The corpus is (width, height, unitSize, tileOrigin), the units of a tileOrigin have to start on its tile borders
+def check_tiling(corpus=((1000, 900, 256, None), (777, 1301, 512, None), (261, 262, 256, None), (1000, 900, 512, -37), (777, 1301, 256, 100))):
+    templates, compiledTemplates = load_compiled_templates()
+    haloY = max(template.foreground.shape[0] for template in compiledTemplates) - 1
+    haloX = max(template.foreground.shape[1] for template in compiledTemplates) - 1
+    for seed, (width, height, unitSize, tileOrigin) in enumerate(corpus):
+        canvasImage = synthetic_megachunk(max(width, height), templates, seed, plants=3000)[:height, :width]
+        expected = naziFinder.match_templates(canvasImage, compiledTemplates)
+        coverage = np.zeros((height, width), dtype=int)
+        detections = []
+        for unit in naziFinder.plan_work_units(0, 0, width, height, unitSize, haloX, haloY, tileOrigin):
+            if tileOrigin is not None and ((unit.x > 0 and (unit.x - tileOrigin) % 256) or (unit.y > 0 and (unit.y - tileOrigin) % 256)):
+                raise AssertionError(f"The work unit at ({unit.x}, {unit.y}) of the {width}x{height} canvas does not start on a tile border")
+            coverage[unit.y:unit.y + unit.coreH, unit.x:unit.x + unit.coreW] += 1
+            view = canvasImage[unit.y:unit.y + unit.h, unit.x:unit.x + unit.w]
+            for color, templateNumber, y, x, mismatches, conflicts in naziFinder.match_templates(view, compiledTemplates, [(0, unit.coreH, 0, unit.coreW)]):
+                detections.append((color, templateNumber, y + unit.y, x + unit.x, mismatches, conflicts))
+        if not (coverage == 1).all():
+            raise AssertionError(f"The work units of the {width}x{height} canvas do not cover it exactly once")
+        if len(set(detections)) != len(detections):
+            raise AssertionError(f"The work units of the {width}x{height} canvas report some matches twice")
+        if sorted(detections) != expected:
+            raise AssertionError(f"The work units of the {width}x{height} canvas miss matches of the full scan")
+    print(f"plan_work_units covers {len(corpus)} synthetic canvases exactly once, with every seam-straddling match found")
+
+# The incremental matching must give what a full rescan gives: tiles of a megachunk are changed between scans (some
+# repainted, some with symbols planted or griefed), and every match_templates_incremental result is compared with
+# match_templates over the core. The megachunk is not tile aligned, so changes reach over tile and core borders
+def check_incremental(size=1300, scans=6, seed=0):
+    templates, compiledTemplates = load_compiled_templates()
+    rng = np.random.default_rng(seed)
+    canvasImage = synthetic_megachunk(size, templates, seed, plants=1500)
+    coreH, coreW = size - 40, size - 25
+    x, y = -65536 + 100, -65536 + 37 # Tile seams at 156 + 256k and 219 + 256k
+    carried = 0
+    with tempfile.TemporaryDirectory() as stateDir:
+        for tolerance in ((0, 0), (1, 1)):
+            for scan in range(scans):
+                if scan > 0:
+                    for change in range(rng.integers(1, 5)):
+                        h, w = rng.integers(1, 300, 2)
+                        cy, cx = rng.integers(0, size - h), rng.integers(0, size - w)
+                        canvasImage[cy:cy + h, cx:cx + w] = synthetic_megachunk(size, templates, seed * 100 + scan * 10 + change, plants=1500)[cy:cy + h, cx:cx + w]
+                stats = naziFinder.collections.Counter()
+                incremental = naziFinder.match_templates_incremental("check", scan, canvasImage, compiledTemplates, 0, 131072, x, y, stateDir, coreH, coreW, stats=stats, tolerance=tolerance)
+                if incremental != naziFinder.match_templates(canvasImage, compiledTemplates, [(0, coreH, 0, coreW)], tolerance=tolerance):
+                    raise AssertionError(f"The incremental matching differs from a full rescan after scan #{scan} with tolerance {tolerance}")
+                carried += stats['tilesCarried']
+
+        # The state is kept per canvas tile, so a run that cuts the same region into other megachunks (here split at
+        # the tile seam of column 668) carries every tile forward
+        stats = naziFinder.collections.Counter()
+        split = naziFinder.match_templates_incremental("check", scans, canvasImage[:, :668 + size - coreW], compiledTemplates, 0, 131072, x, y, stateDir, coreH, 668, stats=stats, tolerance=tolerance)
+        split += [(color, templateNumber, dy, dx + 668, mismatches, conflicts) for color, templateNumber, dy, dx, mismatches, conflicts in naziFinder.match_templates_incremental("check", scans + 1, canvasImage[:, 668:], compiledTemplates, 0, 131072, x + 668, y, stateDir, coreH, coreW - 668, stats=stats, tolerance=tolerance)]
+        if sorted(split) != incremental or stats['tilesMatched'] > 0:
+            raise AssertionError(f"Splitting the megachunk matched {stats['tilesMatched']} tiles again or changed the detections")
+    print(f"incremental matching agrees with a full rescan over {2 * scans} scans of a changing {size}x{size} megachunk ({carried} tiles carried forward) and when it is split in two")
+
+# The color histogram pruning must never drop a match: matching with the pre-scan has to give the same result as
+# matching every color everywhere. Also times both on a canvas-like megachunk
+def bench_pruning(size, repeats, corpus=4):
+    templates, compiledTemplates = load_compiled_templates()
+    for seed in range(corpus):
+        canvasImage = synthetic_megachunk(min(size, 1024), templates, seed, plants=1000, blank=seed / corpus)
+        prescan = naziFinder.prescan_megachunk(canvasImage, compiledTemplates)
+        if naziFinder.match_templates(canvasImage, compiledTemplates, prescan=prescan) != naziFinder.match_templates(canvasImage, compiledTemplates):
+            raise AssertionError(f"The pruned matching misses matches on corpus megachunk #{seed}")
+    print(f"pruned matching agrees with the full matching on {corpus} corpus megachunks")
+
+    # Timed on a set of megachunks as empty as the ones of a real canvas: most are blank, a few are busy
+    megachunks = [synthetic_megachunk(size, templates, seed, plants=size // 64 if blank < 1 else 0, blank=blank) for seed, blank in enumerate((1, 1, 1, 1, 1, 1, 0.99, 0.95, 0.8, 0))]
+    stats = naziFinder.collections.Counter()
+    full_time = best_time(lambda: [naziFinder.match_templates(canvasImage, compiledTemplates) for canvasImage in megachunks], repeats)
+    pruned_time = best_time(lambda: [naziFinder.match_templates(canvasImage, compiledTemplates, prescan=naziFinder.prescan_megachunk(canvasImage, compiledTemplates), stats=stats) for canvasImage in megachunks], repeats)
+    print(f"matching {len(templates)} templates on {len(megachunks)} {size}x{size} megachunks: full {full_time*1000:.1f} ms, pruned {pruned_time*1000:.1f} ms ({full_time/pruned_time:.1f}x, {100 * stats['prunedCombinations'] / stats['combinations']:.1f}% of the combinations pruned)")
+
+# The tolerant matcher must agree with the exact one when no mismatch is allowed, and every match it finds with a
+# tolerance must have exactly the mismatch and conflict counts it reports (counted pixel by pixel). Also times it
+# for growing tolerances, which should barely change its cost
+def bench_tolerance(size, repeats, corpus=3):
+    templates, compiledTemplates = load_compiled_templates()
+    for seed in range(corpus):
+        canvasImage = synthetic_megachunk(min(size, 512), templates, seed, plants=1000)
+        exact = naziFinder.match_templates(canvasImage, compiledTemplates)
+        # Straight through the summed-area tables, without the pruning
+        masks = {color: (canvasImage == color).view(np.uint8) for color in range(len(naziFinder.SEARCHABLE_COLORS_RGB))}
+        approximate = []
+        for color, mask in masks.items():
+            integral = cv2.integral(mask)
+            for templateNumber, template in enumerate(compiledTemplates):
+                boxCounts = naziFinder.color_box_counts(mask, *template.foreground.shape)
+                matches = naziFinder.match_template_approx(integral, boxCounts, template, 0, 0, (0, canvasImage.shape[0], 0, canvasImage.shape[1]))
+                approximate.extend((color, templateNumber, y, x, mismatches, conflicts) for x, y, mismatches, conflicts in zip(*(values.tolist() for values in matches)))
+        approximate.sort()
+        if approximate != exact:
+            raise AssertionError(f"match_template_approx with no tolerance does not agree with match_template_exact on corpus megachunk #{seed}")
+        tolerant = naziFinder.match_templates(canvasImage, compiledTemplates, prescan=naziFinder.prescan_megachunk(canvasImage, compiledTemplates), tolerance=(1, 1))
+        if not set(exact) <= set(tolerant):
+            raise AssertionError(f"The tolerant matching misses exact matches on corpus megachunk #{seed}")
+        # Split into regions, every one only gets the summed-area tables of its own crop
+        H, W = canvasImage.shape
+        regions = [(0, H // 3, 0, W), (H // 3, H, 0, W // 2 + seed), (H // 3, H, W // 2 + seed, W)]
+        if naziFinder.match_templates(canvasImage, compiledTemplates, regions, prescan=naziFinder.prescan_megachunk(canvasImage, compiledTemplates), tolerance=(1, 1)) != tolerant:
+            raise AssertionError(f"The tolerant matching over regions does not agree with it over the whole corpus megachunk #{seed}")
+        for color, templateNumber, y, x, mismatches, conflicts in tolerant:
+            foreground = compiledTemplates[templateNumber].foreground
+            window = canvasImage[y:y + foreground.shape[0], x:x + foreground.shape[1]] == color
+            if (np.count_nonzero(foreground & ~window), np.count_nonzero(~foreground & window)) != (mismatches, conflicts):
+                raise AssertionError(f"The tolerant matching miscounts the match at ({x}, {y}) on corpus megachunk #{seed}")
+        griefed = len({(y, x) for _, _, y, x, mismatches, _ in tolerant if mismatches})
+    print(f"tolerant matching agrees with the exact matching on {corpus} corpus megachunks and counts its mismatches right ({griefed} griefed plants found on the last one)")
+
+    canvasImage = synthetic_megachunk(size, templates)
+    prescan = naziFinder.prescan_megachunk(canvasImage, compiledTemplates)
+    timings = []
+    for tolerance in ((0, 0), (1, 0), (1, 1), (2, 2), (3, 3)):
+        timings.append(f"{tolerance} {best_time(lambda: naziFinder.match_templates(canvasImage, compiledTemplates, prescan=prescan, tolerance=tolerance), repeats)*1000:.0f} ms")
+    print(f"matching {len(templates)} templates on {size}x{size} with (mismatches, conflicts) tolerance: " + ", ".join(timings))
+
+# The detection index must group the detections like a brute-force union of every overlapping pair, and its region
+# and nearest queries must give what checking every cluster gives. Also times building and querying it
+def check_detection_index(count=20000, queries=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    templateSizes = {'small': (5, 5), 'wide': (7, 13), 'large': (21, 21)}
+    # Detections in bursts around a few thousand symbols, so that many overlap, over a 20000x20000 area
+    centers = rng.integers(0, 20000, (count // 4, 2))
+    picked = centers[rng.integers(0, len(centers), count)] + rng.integers(-12, 13, (count, 2))
+    names = list(templateSizes) + ['unknown'] # Unknown templates get the largest size
+    detections = sorted({(int(x), int(y), int(rng.integers(0, 32)), names[rng.integers(0, len(names))], 0, 0) for x, y in picked})
+
+    timer = time.perf_counter()
+    index = naziFinder.DetectionIndex(detections, templateSizes)
+    build_time = time.perf_counter() - timer
+
+    boxes = np.array([(x, y, x + templateSizes.get(template, (21, 21))[1], y + templateSizes.get(template, (21, 21))[0]) for x, y, _, template, _, _ in detections])
+    parent = list(range(len(detections)))
+    def find(number):
+        while parent[number] != number:
+            number = parent[number]
+        return number
+    order = np.argsort(boxes[:, 0])
+    for position, number in enumerate(order): # Every pair whose x ranges overlap, by a sweep along x
+        for other in order[position + 1:]:
+            if boxes[other, 0] >= boxes[number, 2]:
+                break
+            if boxes[other, 1] < boxes[number, 3] and boxes[number, 1] < boxes[other, 3]:
+                parent[find(other)] = find(number)
+    groups = {}
+    for number, detection in enumerate(detections):
+        groups.setdefault(find(number), []).append(detection)
+    if sorted(sorted(group) for group in groups.values()) != sorted(cluster.hits for cluster in index.clusters):
+        raise AssertionError("DetectionIndex does not group the detections like the brute-force union of overlapping pairs")
+
+    clusterBoxes = np.array([cluster[:4] for cluster in index.clusters])
+    regions = [(int(x), int(y), int(x + w), int(y + h)) for x, y, w, h in zip(rng.integers(-100, 20000, queries), rng.integers(-100, 20000, queries), rng.integers(1, 500, queries), rng.integers(1, 500, queries))]
+    points = [(int(x), int(y), int(k)) for x, y, k in zip(rng.integers(-500, 20500, queries), rng.integers(-500, 20500, queries), rng.integers(1, 6, queries))]
+    for region in regions:
+        inside = (clusterBoxes[:, 0] < region[2]) & (region[0] < clusterBoxes[:, 2]) & (clusterBoxes[:, 1] < region[3]) & (region[1] < clusterBoxes[:, 3])
+        if [cluster[:4] for cluster in index.region(*region)] != [tuple(box) for box in clusterBoxes[inside].tolist()]:
+            raise AssertionError(f"DetectionIndex.region{region} does not give the clusters in the region")
+    for x, y, k in points:
+        gaps = np.maximum(np.maximum(clusterBoxes[:, 0], x) - np.minimum(clusterBoxes[:, 2], x + 1), np.maximum(clusterBoxes[:, 1], y) - np.minimum(clusterBoxes[:, 3], y + 1))
+        expected = np.sort(gaps)[:k].tolist()
+        if [naziFinder.box_distance(cluster[:4], (x, y, x + 1, y + 1)) for cluster in index.nearest(x, y, k)] != expected:
+            raise AssertionError(f"DetectionIndex.nearest({x}, {y}, {k}) does not give the nearest clusters")
+
+    region_time = best_time(lambda: [index.region(*region) for region in regions], 1)
+    nearest_time = best_time(lambda: [index.nearest(x, y, k) for x, y, k in points], 1)
+    print(f"DetectionIndex groups {len(detections)} detections into {len(index.clusters)} clusters like the brute force in {build_time*1000:.0f} ms, "
+          f"{queries} region queries agree in {region_time*1000:.0f} ms and {queries} nearest queries in {nearest_time*1000:.0f} ms")
+
+def bench_indexing(size, repeats):
+    lut = naziFinder.SEARCHABLE_LUT
+    image = random_megachunk(size)
+
+    # Both versions must agree on every pixel that is in the palette
+    if not np.array_equal(naziFinder.convert_to_indexed(image, lut), legacy_convert_to_indexed(image, lut)):
+        raise AssertionError("convert_to_indexed does not match the legacy implementation")
+
+    naziFinder.convert_to_indexed(image, lut) # Builds the cached palette table outside of the timing
+    legacy_time = best_time(lambda: legacy_convert_to_indexed(image, lut), repeats)
+    new_time = best_time(lambda: naziFinder.convert_to_indexed(image, lut), repeats)
+    print(f"convert_to_indexed {size}x{size}: legacy {legacy_time*1000:.1f} ms, single-pass {new_time*1000:.1f} ms ({legacy_time/new_time:.1f}x)")
+
+PIPELINE_CANVAS_SIZE = 131072 # Large enough for the region main() scans
+PIPELINE_REGION = (30000, 30000, 10001, 10001) # The region main() scans (start and end are hard coded there)
+
+# Deterministic synthetic canvas over the tiles of PIPELINE_REGION, in the palette indices: a paintedShare of the tiles
+# is painted (large single-color areas and some noise), the others are never painted on and 404.
+# Symbols from ./templates are planted at known positions, two thirds of them straddling tile seams (where the
+# megachunks meet too) or the 256 pixel seams from the region corner. Every other plant is a decoy,
+# griefed by one pixel, which must not be found.
+# Returns the tiles as {(tx, ty): indexed 256x256 array} and the planted symbols and decoys as sets of (x, y, color, template name)
+def synthetic_canvas(paintedShare, plants, seed=0):
+    rng = np.random.default_rng(seed)
+    colorCount = len(naziFinder.SEARCHABLE_COLORS_RGB)
+    offset = PIPELINE_CANVAS_SIZE // 2
+    regionX, regionY, width, height = PIPELINE_REGION
+    tx0, ty0 = (regionX + offset) // 256, (regionY + offset) // 256
+    tilesW, tilesH = (regionX + width - 1 + offset) // 256 - tx0 + 1, (regionY + height - 1 + offset) // 256 - ty0 + 1
+    canvasImage = np.zeros((tilesH * 256, tilesW * 256), dtype=np.uint8) # Starts at tile (tx0, ty0)
+    painted = rng.random((tilesH, tilesW)) < paintedShare
+    for ty, tx in zip(*np.nonzero(painted)):
+        tile = canvasImage[ty * 256:(ty + 1) * 256, tx * 256:(tx + 1) * 256]
+        tile[:] = np.kron(rng.integers(0, colorCount, size=(4, 4)).astype(np.uint8), np.ones((64, 64), dtype=np.uint8))
+        noise = rng.random((256, 256)) < 0.02
+        tile[noise] = rng.integers(0, colorCount, size=np.count_nonzero(noise))
+
+    templates = naziFinder.load_templates()
+    occupied = np.zeros(canvasImage.shape, dtype=bool) # Plants may not touch each other, or they could grief each other
+    planted, decoys = set(), set()
+    originX, originY = tx0 * 256 - offset, ty0 * 256 - offset # Canvas coordinates of canvasImage[0, 0]
+    attempts = 0
+    while len(planted) + len(decoys) < plants and attempts < 100 * plants:
+        attempts += 1
+        template = templates[rng.integers(len(templates))]
+        th, tw = template.foreground.shape
+        x, y = rng.integers(regionX, regionX + width - tw), rng.integers(regionY, regionY + height - th)
+        if attempts % 3: # Straddling a seam (vertical, horizontal or both)
+            phaseX, phaseY = ((-offset - regionX) % 256, (-offset - regionY) % 256) if rng.random() < 0.5 else (0, 0) # Tile seams or seams from the region corner
+            if attempts % 3 == 1 or rng.random() < 0.5:
+                x = regionX + phaseX + rng.integers(1, width // 256) * 256 - rng.integers(1, tw)
+            if attempts % 3 == 2 or rng.random() < 0.5:
+                y = regionY + phaseY + rng.integers(1, height // 256) * 256 - rng.integers(1, th)
+        if not (regionX <= x and x + tw <= regionX + width and regionY <= y and y + th <= regionY + height):
+            continue
+        iy, ix = y - originY, x - originX
+        if occupied[max(iy - 1, 0):iy + th + 1, max(ix - 1, 0):ix + tw + 1].any():
+            continue
+        occupied[iy:iy + th, ix:ix + tw] = True
+        painted[iy // 256:(iy + th - 1) // 256 + 1, ix // 256:(ix + tw - 1) // 256 + 1] = True
+        window = canvasImage[iy:iy + th, ix:ix + tw]
+        color = int(rng.integers(colorCount))
+        window[window == color] = (color + 1) % colorCount
+        window[template.foreground] = color
+        if (len(planted) + len(decoys)) % 2:
+            window[template.foreground.shape[0] // 2, template.foreground.shape[1] // 2] = (color + 2) % colorCount
+            decoys.add((int(x), int(y), color, template.name))
+        else:
+            planted.add((int(x), int(y), color, template.name))
+    tiles = {(tx0 + tx, ty0 + ty): canvasImage[ty * 256:(ty + 1) * 256, tx * 256:(tx + 1) * 256] for ty, tx in zip(*np.nonzero(painted))}
+    return tiles, planted, decoys
+
+# Stand-in for pixmap.fun on 127.0.0.1:port: /api/me lists canvas 0, routes ({path: handler}) serve the rest.
+# Runs on its own thread
+def serve_stand_in(routes, port):
+    async def me(request):
+        return web.json_response({'canvases': {'0': {'title': 'benchmark', 'size': PIPELINE_CANVAS_SIZE, 'colors': naziFinder.SEARCHABLE_COLORS_RGB}}})
+
+    app = web.Application()
+    app.router.add_get('/api/me', me)
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+# Stand-in for the backups: the tiles are served on every date (at <storage>/YYYY/MM/DD/0/tiles/<tx>/<ty>.png,
+# 404 for the unpainted ones)
+def serve_canvas(pngs, port):
+    async def tile(request):
+        data = pngs.get((int(request.match_info['tx']), int(request.match_info['ty'])))
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data, content_type='image/png')
+
+    serve_stand_in({'/{year}/{month}/{day}/0/tiles/{tx}/{ty}.png': tile}, port)
+
+# The TileFetcher against a stand-in that fails on purpose: a tile that answers 500 twice, one that is too slow once,
+# one that always answers 500 and one that only exists on the day before. Every retry, status count, TileFetchError
+# and the fallback to the earlier date has to come out as expected
+def check_fetcher(port=18768):
+    image = PIL.Image.fromarray(np.full((256, 256), 3, dtype=np.uint8), 'P')
+    image.putpalette(sum(naziFinder.SEARCHABLE_COLORS_RGB, []))
+    png = io.BytesIO()
+    image.save(png, 'PNG')
+    attempts = {} # (date, tx, ty) -> requests so far
+    async def tile(request):
+        date = request.match_info['year'] + request.match_info['month'] + request.match_info['day']
+        key = (date, int(request.match_info['tx']), int(request.match_info['ty']))
+        attempts[key] = attempts.get(key, 0) + 1
+        tx = key[1]
+        if tx == 2: # Missing
+            return web.Response(status=404)
+        if (tx == 3 and attempts[key] <= 2) or tx == 5 or (tx == 6 and date == '20250102'): # Server errors
+            return web.Response(status=500)
+        if tx == 4 and attempts[key] == 1: # Slower than the fetcher waits
+            await asyncio.sleep(1)
+        if tx == 7: # Repainted after its second request, answers 304 while the ETag still matches
+            etag = '"v1"' if attempts[key] <= 2 else '"v2"'
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers={'ETag': etag})
+            return web.Response(body=png.getvalue(), content_type='image/png', headers={'ETag': etag})
+        return web.Response(body=png.getvalue(), content_type='image/png')
+    serve_stand_in({'/{year}/{month}/{day}/0/tiles/{tx}/{ty}.png': tile}, port)
+
+    lut = naziFinder.SEARCHABLE_LUT
+    def decode(data):
+        return naziFinder.decode_tile_indexed(data, lut)
+    async def fetch_all():
+        results = {}
+        async with naziFinder.TileFetcher(f"http://127.0.0.1:{port}", rateLimit=0, maxAttempts=3, backoffBase=0.01, backoffCap=0.05, timeout=0.3) as fetcher:
+            for tx in (1, 2, 3, 4, 5):
+                try:
+                    results[tx] = await fetcher.fetch_tile('0', '20250102', tx, 0, decode)
+                except naziFinder.TileFetchError:
+                    results[tx] = 'TileFetchError'
+            canvasImage = np.zeros((256, 256), dtype=np.uint8)
+            results[6] = await naziFinder.fetch_chunk(fetcher, '0', naziFinder.fallback_dates(datetime.date(2025, 1, 2), 1), 6, 0, 0, 0, canvasImage, lut, 0)
+            results['fallbackPixels'] = int(np.count_nonzero(canvasImage == 3))
+        return fetcher, results
+    fetcher, results = asyncio.run(fetch_all())
+
+    if results[1] is None or results[2] is not None or results[3] is None or results[4] is None or results[5] != 'TileFetchError':
+        raise AssertionError(f"TileFetcher gives the wrong results: {results}")
+    if results[6] != '20250101' or results['fallbackPixels'] != 256 * 256:
+        raise AssertionError(f"fetch_chunk does not fall back to the day before: {results[6]}")
+    timeouts = sum(count for status, count in fetcher.statusCounts.items() if not isinstance(status, int))
+    statuses = {status: count for status, count in fetcher.statusCounts.items() if isinstance(status, int)}
+    if statuses != {200: 4, 404: 1, 500: 8} or timeouts != 1:
+        raise AssertionError(f"TileFetcher counts the wrong statuses: {dict(fetcher.statusCounts)}")
+    if fetcher.retries != 7:
+        raise AssertionError(f"TileFetcher retried {fetcher.retries} times instead of 7")
+    print(f"TileFetcher retries the 500s and the timeout, gives up after its attempts and fetch_chunk falls back a day ({fetcher.metrics_summary()})")
+
+    # Through the tile cache, a tile of a past day is fetched once, while one of today is revalidated on every fetch
+    today = datetime.date.today().strftime("%Y%m%d")
+    async def fetch_cached(cacheDir):
+        async with naziFinder.TileFetcher(f"http://127.0.0.1:{port}", rateLimit=0, cacheDir=cacheDir) as fetcher:
+            for date in ('20250102', '20250102', today, today, today):
+                if await fetcher.fetch_tile('0', date, 7, 0, decode) is None:
+                    raise AssertionError(f"TileFetcher lost tile 7,0 of {date} in the tile cache")
+        return fetcher
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fetcher = asyncio.run(fetch_cached(cacheDir))
+    # The past one is downloaded once, today's is downloaded, revalidated with a 304, then downloaded again once repainted
+    if dict(fetcher.statusCounts) != {200: 3, 304: 1} or fetcher.cacheHits != 2:
+        raise AssertionError(f"The tile cache does not revalidate today's tiles: {fetcher.metrics_summary()}")
+    print(f"The tile cache keeps past tiles and revalidates today's ({fetcher.metrics_summary()})")
+
+# Runs the whole main() pipeline (as its own process) against a synthetic canvas on the local stand-in, and reports
+# its throughput, peak memory, and recall and precision against the planted symbols
+def bench_pipeline(paintedShare=0.25, plants=400, workers=None, port=18766):
+    timer_start = time.perf_counter()
+    tiles, planted, decoys = synthetic_canvas(paintedShare, plants)
+    pngs = {}
+    for key, tile in tiles.items():
+        image = PIL.Image.fromarray(tile, 'P')
+        image.putpalette([channel for color in naziFinder.SEARCHABLE_COLORS_RGB for channel in color])
+        data = io.BytesIO()
+        image.save(data, 'PNG')
+        pngs[key] = data.getvalue()
+    print(f"synthetic canvas: {len(pngs)} painted tiles, {len(planted)} symbols and {len(decoys)} decoys planted in {time.perf_counter() - timer_start:.1f} s")
+    serve_canvas(pngs, port)
+
+    workDir = tempfile.mkdtemp(prefix='naziFinderBench')
+    try:
+        shutil.copytree('./templates', os.path.join(workDir, 'templates'))
+        command = [sys.executable, os.path.abspath('naziFinder.py'), '0', '--api-url', f'http://127.0.0.1:{port}', '--storage-url', f'http://127.0.0.1:{port}', '--rate-limit', '0', '--no-cache']
+        if workers is not None:
+            command += ['--workers', str(workers)]
+        timer_start = time.perf_counter()
+        subprocess.run(command, cwd=workDir, stdout=subprocess.DEVNULL, check=True)
+        wallSeconds = time.perf_counter() - timer_start
+        peakRssMB = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 # Largest process of the run
+
+        with open(os.path.join(workDir, 'profiles', 'run1.json')) as profileFile:
+            profile = json.load(profileFile)
+        connection = sqlite3.connect(os.path.join(workDir, 'results.sqlite'))
+        found = set(connection.execute("SELECT x, y, color, template FROM detections WHERE run = 1").fetchall())
+        connection.close()
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    hits = len(found & planted)
+    recall = hits / len(planted) if planted else 1
+    precision = hits / len(found) if found else 1
+    totalRssMB = sum(peak for peak in profile['peakRssMB'].values() if peak is not None) - (profile['peakRssMB']['children'] or 0)
+    print(f"pipeline on {profile['tiles']} tiles in {profile['megachunks']} megachunks: {wallSeconds:.1f} s, {profile['tiles'] / wallSeconds:.0f} tiles/s, {profile['megachunks'] / wallSeconds:.2f} megachunks/s, peak RSS {peakRssMB:.0f} MB (largest process), {totalRssMB:.0f} MB (all processes)")
+    print(f"recall {100 * recall:.1f}% ({hits} of {len(planted)} planted symbols), precision {100 * precision:.1f}% ({len(found) - hits} false detections, {len(found & decoys)} of them decoys)")
+    print("stage seconds: " + ", ".join(f"{stage} {seconds:.1f}" for stage, seconds in profile['stageSeconds'].items()))
+    if recall < 1 or precision < 1:
+        raise AssertionError("The pipeline does not find exactly the planted symbols")
+
+# Stand-in for the live canvas: <api>/chunks/0/<cx>/<cy>.bmp serves the raw palette indices of the tiles in chunks
+# (404 for the unpainted ones), with an ETag so unchanged chunks answer 304
+def serve_live_canvas(chunks, port):
+    async def chunk(request):
+        data = chunks.get((int(request.match_info['cx']), int(request.match_info['cy'])))
+        if data is None:
+            return web.Response(status=404)
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=data, content_type='application/octet-stream', headers={'ETag': etag})
+
+    serve_stand_in({'/chunks/0/{cx}/{cy}.bmp': chunk}, port)
+
+# Runs --watch (as its own process) against a live stand-in that replays changes: after every poll, some planted
+# symbols are griefed by one pixel and some decoys are repaired. Every change has to come out as one removed or
+# appeared event by the next poll. Reports the event latency, the poll time and the memory of the watcher over the polls
+def bench_watch(polls=8, changesPerPoll=5, paintedShare=0.1, plants=200, port=18767):
+    tiles, planted, decoys = synthetic_canvas(paintedShare, plants)
+    chunks = {key: tile.tobytes() for key, tile in tiles.items()}
+    serve_live_canvas(chunks, port)
+    foregrounds = {template.name: template.foreground for template in naziFinder.load_templates()}
+    offset = PIPELINE_CANVAS_SIZE // 2
+    colorCount = len(naziFinder.SEARCHABLE_COLORS_RGB)
+
+    # Sets the middle pixel of a planted symbol or decoy: the symbol color repairs it, another one griefs it
+    def set_middle_pixel(symbol, grief):
+        x, y, color, name = symbol
+        foreground = foregrounds[name]
+        my, mx = foreground.shape[0] // 2, foreground.shape[1] // 2
+        key = ((x + mx + offset) // 256, (y + my + offset) // 256)
+        tiles[key][(y + my + offset) % 256, (x + mx + offset) % 256] = (color + 2) % colorCount if grief == foreground[my, mx] else color if foreground[my, mx] else (color + 1) % colorCount
+        chunks[key] = tiles[key].tobytes()
+
+    workDir = tempfile.mkdtemp(prefix='naziFinderWatch')
+    rng = np.random.default_rng(1)
+    present, absent = sorted(planted), sorted(decoys)
+    changedAt = {} # (x, y, template) -> how it was changed and when
+    rss = []
+    try:
+        shutil.copytree('./templates', os.path.join(workDir, 'templates'))
+        command = [sys.executable, os.path.abspath('naziFinder.py'), '0', '--watch', '--watch-interval', '0', '--watch-polls', str(polls), '--api-url', f'http://127.0.0.1:{port}', '--rate-limit', '0']
+        process = subprocess.Popen(command, cwd=workDir, stdout=subprocess.PIPE, text=True)
+        pollSeconds = []
+        for line in process.stdout:
+            if not line.startswith('Poll #'):
+                continue
+            pollSeconds.append(float(line.rsplit(' in ', 1)[1].split()[0]))
+            with open(f'/proc/{process.pid}/status') as status:
+                rss.append(next(int(field.split()[1]) for field in status if field.startswith('VmRSS')) / 1024)
+            if len(pollSeconds) < polls - 1: # The last poll only collects the events of the last changes
+                for _ in range(changesPerPoll):
+                    if rng.random() < 0.5 and present:
+                        symbol = present.pop(rng.integers(len(present)))
+                        set_middle_pixel(symbol, True)
+                        absent.append(symbol)
+                        changedAt[symbol[:2] + symbol[3:]] = ('removed', time.time())
+                    elif absent:
+                        symbol = absent.pop(rng.integers(len(absent)))
+                        set_middle_pixel(symbol, False)
+                        present.append(symbol)
+                        changedAt[symbol[:2] + symbol[3:]] = ('appeared', time.time())
+        process.wait()
+
+        current, latencies = set(), []
+        with open(os.path.join(workDir, 'watchEvents.jsonl')) as events:
+            for line in events:
+                event = json.loads(line)
+                symbol = (event['x'], event['y'], event['template']) # Plants never overlap, so this tells them apart
+                if event['event'] == 'appeared':
+                    current.add(symbol)
+                else:
+                    current.discard(symbol)
+                if symbol in changedAt and changedAt[symbol][0] == event['event']:
+                    latencies.append(datetime.datetime.fromisoformat(event['time']).timestamp() - changedAt[symbol][1])
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    expected = {(x, y, name) for x, y, _, name in present}
+    print(f"watch: {polls} polls of {len(chunks)} painted chunks, {len(changedAt)} symbols changed, poll {np.median(pollSeconds):.2f} s (median), event latency {np.mean(latencies):.2f} s (mean) {max(latencies, default=0):.2f} s (max)")
+    print(f"watcher RSS after every poll (MB): " + ", ".join(f"{value:.0f}" for value in rss))
+    if current != expected or len(latencies) != len(changedAt):
+        raise AssertionError(f"The watch events do not follow the changes ({len(current ^ expected)} symbols differ, {len(changedAt) - len(latencies)} changes without their event)")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        bench_watch(int(sys.argv[2]) if len(sys.argv) > 2 else 8, int(sys.argv[3]) if len(sys.argv) > 3 else 5)
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'pipeline':
+        bench_pipeline(float(sys.argv[2]) if len(sys.argv) > 2 else 0.25, int(sys.argv[3]) if len(sys.argv) > 3 else 400, int(sys.argv[4]) if len(sys.argv) > 4 else None)
+        return
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2560
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    bench_indexing(size, repeats)
+    bench_matching(size, repeats)
+    bench_pruning(size, repeats)
+    bench_tolerance(size, repeats)
+    check_tiling()
+    check_incremental()
+    check_fetcher()
+    check_detection_index()
+
+if __name__ == "__main__":
+    main()
@@ -15,12 +15,92 @@ import multiprocessing
 import urllib.request
 import json
 import traceback
+import random
+import argparse
+import hashlib
+import collections
+import heapq
+import sqlite3
+import threading
+from multiprocessing import shared_memory
+from queue import Empty
+try:
+    import resource # Peak memory in the run profile, not on Windows
+except ImportError:
+    resource = None
 
 USER_AGENT = "pmfun naziFinder 1.0.2 " + ' '.join(sys.argv[1:])
 PPFUN_URL = "https://pixmap.fun"
 PPFUN_STORAGE_URL = "https://backup.pixmap.fun"
 
-file_lock = asyncio.Lock()
+UNKNOWN_COLOR_INDEX = 255 # LUT index of pixels that are not in the palette
+FETCH_CONCURRENCY = 4 # Megachunks fetched at the same time when a run starts, the scheduler changes it as the run goes
+TILE_RATE_LIMIT = 100 # Tile requests per second per host (--rate-limit), 0 for no cap
+REBALANCE_INTERVAL = 2 # Seconds between two looks of the scheduler at the fetch and match stages
+SWEEP_POLL_INTERVAL = 0.2 # Seconds between two looks at the work ledger for the units a sweep holds back
+PRUNE_BLOCK_SIZE = 256 # Size of the blocks the color histograms of the pre-scan are made for
+SHARD_UNIT_SIZE = 2048 # Unit size of --shard runs, every node has to plan the same units whatever its workers and memory
+SNAPSHOT_MAGIC = b"NFSNAP1\n"
+SNAPSHOT_DATA_OFFSET = 4096 # The indices start page aligned, so they can be memory-mapped
+WATCH_UNIT_SIZE = 2048 # Unit size the first match of --watch goes through the region in
+CLUSTER_CELL_SIZE = 64 # Size of the grid cells the detection index keeps its clusters in
+EVIDENCE_MARGIN = 16 # Canvas pixels shown around a cluster in its evidence crop
+EVIDENCE_SCALE = 8 # Evidence crops are scaled up this many times, so single pixels can be seen
+LIVE_CHUNK_BITMASK = 0x3F # The bytes of the live chunks hold the palette index in their low bits, the high ones flag protected pixels
+
+# (Swastika) colors to look for
+SEARCHABLE_COLORS_RGB = [
+    # White to Black
+    [255, 255, 255], [228, 228, 228], [196, 196, 196], [136, 136, 136], [78, 78, 78], [0, 0, 0],
+    # Pink to Red
+    [244, 179, 174], [255, 167, 209], [255, 84, 178], [255, 101, 101], [229, 0, 0], [154, 0, 0],
+    # Orange to Brown
+    [254, 164, 96], [229, 149, 0], [160, 106, 66], [96, 64, 40],
+    # Tan to Yellow
+    [245, 223, 176], [255, 248, 137], [229, 217, 0],
+    # Light Green to Dark Green
+    [148, 224, 68], [2, 190, 1], [104, 131, 56], [0, 101, 19],
+    # Light Blue to Dark Blue
+    [202, 227, 255], [0, 211, 221], [0, 131, 199], [0, 0, 234], [25, 25, 115],
+    # Lavender to (Purple to) Light Red
+    [207, 110, 228], [130, 0, 128], [83, 39, 68], [125, 46, 78], [193, 55, 71],
+    # Orange to Orange
+    [214, 113, 55], [252, 154, 41],
+    # Dark Purple to Orange
+    [68, 33, 57], [131, 51, 33], [163, 61, 24], [223, 96, 22],
+    # Dark Blue to Light Blue
+    [31, 37, 127], [10, 79, 175], [10, 126, 230], [88, 237, 240],
+    # Dark Purple to Lavander
+    [37, 20, 51], [53, 33, 67], [66, 21, 100], [74, 27, 144], [110, 75, 237],
+    # Dark Green to Lime
+    [16, 58, 47], [16, 74, 31], [16, 142, 47], [16, 180, 47], [117, 215, 87]
+]
+
+# Names of the LUT indices above
+LUT_COLOR_NAMES = {
+    0: "White", 1: "Off-White", 2: "Silver", 3: "Gray", 4: "Dark Gray",
+    5: "Black", 6: "Lite Pink", 7: "More Pink", 8: "Hot Pink", 9: "Lipstick Red 1",
+    10: "Red", 11: "Dark Red", 12: "Dark Tan", 13: "Tangerine", 14: "Light Brown",
+    15: "Coffee", 16: "Light Tan", 17: "Light Yellow", 18: "Mustard Yellow", 19: "Lime",
+    20: "Green", 21: "Green Bean", 22: "Camo Green 1", 23: "Cloud Blue    ", 24: "Robin Egg Blue",
+    25: "Medium Blue 1", 26: "Blue", 27: "Bluejean", 28: "Lavener", 29: "Eggplant",
+    30: "Ugly Purple?", 31: "Purple-Red Mix", 32: "Lipstick Red 2", 33: "Trump Tan", 34: "Caution Yellow",
+    35: "Purple (Brown)", 36: "Chocholate", 37: "Milk Chocholate", 38: "Orange", 39: "Lapis Lazuli",
+    40: "TheBlueCorner", 41: "Medium Blue 2", 42: "Turquoise", 43: "Purple-Black 1", 44: "Purple-Black 2",
+    45: "Dark Purple", 46: "Purple", 47: "Light Purple", 48: "Dark Green", 49: "Camo Green 2",
+    50: "Grass Green 1", 51: "Grass Green 2", 52: "Light Green"
+}
+
+# How the collector and the match processes are started (and their queues made): from a forkserver, or spawned where
+# there is none, never forked. The scheduler adds match processes while the main process runs the decode, resolver and
+# queue feeder threads, and a fork could copy a lock one of them holds
+PROCESS_CONTEXT = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+palette_table_cache = {} # Packed BGR -> LUT index tables, one per LUT
+template_cache = {} # Compiled templates of this process, keyed on the template file hashes
+
+# A template turned into the offsets the exact matcher tests
+CompiledTemplate = collections.namedtuple('CompiledTemplate', ['name', 'foreground', 'anchor', 'checks', 'rectangles'])
 
 def clear_screen():
     system_name = platform.system()
@@ -29,9 +109,16 @@ def clear_screen():
     else:
         os.system('clear')
 
+# Peak resident memory in MB of this process (or of its dead children), None where it cannot be read
+def peak_rss_mb(who=None):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1) # Bytes on macOS, KB elsewhere
+
 # Fetches the user data to use
-def fetchMe():
-    url = f"{PPFUN_URL}/api/me"
+def fetchMe(apiUrl=PPFUN_URL):
+    url = f"{apiUrl}/api/me"
     headers = {
       'User-Agent': USER_AGENT
     }
@@ -52,278 +139,1682 @@ def fetchMe():
             print(f"Failed to load {url}, trying again in 5s: {e}")
             time.sleep(5)  # Sleep 5 seconds before retrying
             
-# Gets the chunk (fraction of megachunk)
-async def fetch_chunk(session, url, offx, offy, image, bkg, needed = False):
-    attempts = 0
-    headers = {
-      'User-Agent': USER_AGENT
-    }
-    while True:
+# Gets the chunk (fraction of megachunk) and decodes it straight into the megachunk index buffer.
+# If the tile 404s, fails to decode or cannot be fetched, it is taken from the most recent earlier date (in fetchDates) that has it.
+# Returns the date the tile came from, or None if no date had it (then it is filled with the background color).
+# Its decode and index seconds, bytes and 404s are added to profile
+async def fetch_chunk(fetcher, canvas_id, fetchDates, ix, iy, offx, offy, canvasImage, lut, bkg, profile=None):
+    timings = collections.Counter() # Only one attempt at a time writes to it, from the decode thread
+    def decode(data):
+        timings['tileBytes'] += len(data)
+        return decode_tile_indexed(data, lut, timings)
+
+    try:
+        for iter_date in fetchDates:
+            try:
+                decoded = await fetcher.fetch_tile(canvas_id, iter_date, ix, iy, decode)
+            except TileFetchError as e:
+                print(f"WARNING: {e}, trying an earlier date")
+                continue
+            except (OSError, ValueError) as e: # PIL could not decode it
+                print(f"WARNING: Tile ({ix}, {iy}) of {iter_date} does not decode ({e}), trying an earlier date")
+                continue
+            if decoded is None: # 404
+                timings['tiles404'] += 1
+                continue
+            tile, opaque = decoded
+            paste_indexed(canvasImage, tile, offx, offy, opaque)
+            return iter_date
+        paste_indexed(canvasImage, np.full((256, 256), bkg, dtype=np.uint8), offx, offy) # Never painted on (or lost)
+        return None
+    finally:
+        if profile is not None:
+            profile.update(timings)
+
+# The dates a tile is looked for on: the scan date, then every earlier day up to fallbackDays back
+def fallback_dates(start_date, fallbackDays):
+    return [(start_date - datetime.timedelta(days=daysBack)).strftime("%Y%m%d") for daysBack in range(fallbackDays + 1)]
+
+class TileFetchError(Exception):
+    pass
+
+# The one fetch engine of a run. Every backup tile goes through it, so all of them share one connection pool,
+# one limit on the tiles in flight, one request rate per host and one set of metrics.
+# Failed requests (anything but 200 and 404, or a connection error/timeout) are retried with exponential backoff and jitter
+class TileFetcher:
+    def __init__(self, storageUrl=PPFUN_STORAGE_URL, connections=16, maxInFlight=64, rateLimit=TILE_RATE_LIMIT, maxAttempts=6, backoffBase=0.5, backoffCap=30, timeout=60, cacheDir=None):
+        self.storageUrl = storageUrl
+        self.connections = connections
+        self.rateLimit = rateLimit # Requests per second per host, 0 for no cap
+        self.maxAttempts = maxAttempts
+        self.backoffBase = backoffBase
+        self.backoffCap = backoffCap
+        self.timeout = timeout
+        self.cacheDir = cacheDir
+        self.inFlight = asyncio.Semaphore(maxInFlight)
+        self.nextSlot = {} # Host -> earliest time the next request may start
+        self.session = None
+        self.decodePool = None # Thread pool the tiles are decoded in (on the event loop when None)
+
+        # Metrics
+        self.statusCounts = collections.Counter() # HTTP status (or exception name) -> number of responses
+        self.retries = 0
+        self.cacheHits = 0
+        self.bytesDownloaded = 0
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections, limit_per_host=self.connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'User-Agent': USER_AGENT})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def tile_url(self, canvas_id, iter_date, tx, ty):
+        return '%s/%s/%s/%s/%s/tiles/%s/%s.png' % (self.storageUrl, iter_date[0:4], iter_date[4:6], iter_date[6:], canvas_id, tx, ty)
+
+    # Waits until the per-host request rate allows another request
+    async def wait_for_rate(self, host):
+        if self.rateLimit <= 0:
+            return
+        now = time.monotonic()
+        slot = max(now, self.nextSlot.get(host, now))
+        self.nextSlot[host] = slot + 1 / self.rateLimit
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    # Gets one backup tile and returns decode(data), or None if the tile 404'd.
+    # Tiles are only written to the tile cache once they decoded. Cached tiles of a day that was not over when they
+    # were cached are revalidated with a conditional request, and only downloaded again if they changed
+    async def fetch_tile(self, canvas_id, iter_date, tx, ty, decode):
+        headers = None
+        if self.cacheDir is not None:
+            cached, data = tile_cache_get(self.cacheDir, canvas_id, iter_date, tx, ty)
+            validators = tile_cache_validators(self.cacheDir, canvas_id, iter_date, tx, ty) if cached and data is not None else None
+            if cached and validators is None:
+                self.cacheHits += 1
+                if data is None:
+                    return None
+                return decode(data) if self.decodePool is None else await asyncio.get_running_loop().run_in_executor(self.decodePool, decode, data)
+            if validators is not None:
+                headers = {}
+                if validators.get('ETag'):
+                    headers['If-None-Match'] = validators['ETag']
+                if validators.get('Last-Modified'):
+                    headers['If-Modified-Since'] = validators['Last-Modified']
+
+        status, newData, respHeaders = await self.get(self.tile_url(canvas_id, iter_date, tx, ty), headers)
+        if status == 304:
+            self.cacheHits += 1
+            newData, respHeaders = data, validators # Still the cached tile
+        if status == 404:
+            if self.cacheDir is not None:
+                tile_cache_put(self.cacheDir, canvas_id, iter_date, tx, ty, None)
+            return None
+        decoded = decode(newData) if self.decodePool is None else await asyncio.get_running_loop().run_in_executor(self.decodePool, decode, newData)
+        if self.cacheDir is not None:
+            tile_cache_put(self.cacheDir, canvas_id, iter_date, tx, ty, newData, respHeaders)
+        return decoded
+
+    # GETs a URL with the retries, rate limit and metrics of the fetcher (headers are added to the request, e.g. to make
+    # it conditional). Returns (status, body, response headers) of the first 200, 304 or 404 response, the body is None
+    # unless it is a 200
+    async def get(self, url, headers=None):
+        host = url.split('/')[2]
+        for attempt in range(self.maxAttempts):
+            if attempt > 0:
+                self.retries += 1
+                delay = min(self.backoffCap, self.backoffBase * 2 ** (attempt - 1))
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2)) # Jitter, so failed tiles do not retry in lockstep
+            async with self.inFlight:
+                await self.wait_for_rate(host)
+                try:
+                    async with self.session.get(url, headers=headers) as resp:
+                        self.statusCounts[resp.status] += 1
+                        if resp.status in (304, 404):
+                            return resp.status, None, resp.headers
+                        if resp.status != 200:
+                            continue
+                        data = await resp.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.statusCounts[type(e).__name__] += 1
+                    continue
+            self.bytesDownloaded += len(data)
+            return resp.status, data, resp.headers
+        raise TileFetchError(f"Could not get {url} in {self.maxAttempts} tries")
+
+    def metrics_summary(self):
+        statuses = ', '.join(f"{status}: {count}" for status, count in sorted(self.statusCounts.items(), key=lambda item: str(item[0])))
+        return f"Tile requests ({statuses or 'none'}), {self.retries} retries, {self.cacheHits} cache hits, {self.bytesDownloaded / 1024 / 1024:.1f} MB downloaded"
+
+# Stands in for a TileFetcher when the tiles are PNGs in a local directory, laid out like one day of the
+# backups (<tilesDir>/<tx>/<ty>.png). Missing files count as 404s
+class LocalTileSource:
+    def __init__(self, tilesDir):
+        self.tilesDir = tilesDir
+        self.cacheDir = None
+        self.tilesRead = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def fetch_tile(self, canvas_id, iter_date, tx, ty, decode):
+        path = os.path.join(self.tilesDir, str(tx), f"{ty}.png")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.tilesRead += 1
+        return decode(data)
+
+    def metrics_summary(self):
+        return f"{self.tilesRead} tiles read from {self.tilesDir}"
+
+# Path (without extension) of a tile in the tile cache, which is keyed on (canvas, date, tx, ty)
+def tile_cache_path(cacheDir, canvas_id, iter_date, tx, ty):
+    return os.path.join(cacheDir, str(canvas_id), iter_date, f"{tx}_{ty}")
+
+# Looks a tile up in the tile cache. Returns (False, None) on a miss, (True, None) for a cached 404
+# and (True, data) for a cached tile. Hits are touched, which is what the LRU eviction goes by
+def tile_cache_get(cacheDir, canvas_id, iter_date, tx, ty):
+    path = tile_cache_path(cacheDir, canvas_id, iter_date, tx, ty)
+    for extension in ('.png', '.404'):
         try:
-            async with session.get(url, headers=headers) as resp:
-                if resp.status == 404:
-                    if needed:
-                        img = PIL.Image.new('RGB', (256, 256), color=bkg)
-                        image.paste(img, (offx, offy))
-                        img.close()
-                    return
-                if resp.status != 200:
-                    if needed:
-                        continue
-                    return
-                data = await resp.read()
-                img = PIL.Image.open(io.BytesIO(data)).convert('RGBA')
-                image.paste(img, (offx, offy), img)
-                img.close()
-                return
-        except:
-            if attempts > 3:
-                raise
-            attempts += 1
+            with open(path + extension, 'rb') as cacheFile:
+                data = cacheFile.read()
+            os.utime(path + extension)
+        except FileNotFoundError:
+            continue
+        return True, (data if extension == '.png' else None)
+    return False, None
+
+# Validators (ETag and Last-Modified) of a cached tile that has to be revalidated before it is used, None for the
+# tiles that are final
+def tile_cache_validators(cacheDir, canvas_id, iter_date, tx, ty):
+    try:
+        with open(tile_cache_path(cacheDir, canvas_id, iter_date, tx, ty) + '.validators', 'r') as validatorsFile:
+            return json.load(validatorsFile)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        return {} # Unreadable, the tile is revalidated without conditions
+
+# Stores a tile (or, with data None, a 404) in the tile cache.
+# Backup days never change once published, but today's may not be complete yet: its 404s are not remembered, and its
+# tiles are stored with the validators of their response, so later runs revalidate them until the day is over
+def tile_cache_put(cacheDir, canvas_id, iter_date, tx, ty, data, respHeaders=None):
+    changing = iter_date >= datetime.date.today().strftime("%Y%m%d")
+    if data is None and changing:
+        return
+    path = tile_cache_path(cacheDir, canvas_id, iter_date, tx, ty)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if changing:
+        validators = {name: (respHeaders or {}).get(name) for name in ('ETag', 'Last-Modified')}
+        with open(path + '.validators.tmp', 'w') as validatorsFile:
+            json.dump(validators, validatorsFile)
+        os.replace(path + '.validators.tmp', path + '.validators')
+    extension = '.404' if data is None else '.png'
+    with open(path + extension + '.tmp', 'wb') as cacheFile:
+        cacheFile.write(data or b'')
+    os.replace(path + extension + '.tmp', path + extension) # Readers never see half a tile
+    if not changing:
+        try:
+            os.remove(path + '.validators') # Revalidated after its day was over, the tile is final now
+        except FileNotFoundError:
             pass
 
-def get_lut_index(LUT, target_color):
-    # Use np.all to check for exact match across all 3 channels
-    for idx, color in enumerate(LUT):
-        if np.array_equal(color, target_color):  # Check if the colors match
-            return idx
-    return -1  # Return -1 if no match is found
+# Deletes the least recently used tiles until the tile cache fits in maxBytes. Returns how many were deleted.
+# Validators are only deleted with their tile, since a cached tile without them counts as final
+def tile_cache_evict(cacheDir, maxBytes):
+    entries = []
+    totalBytes = 0
+    for root, _, filenames in os.walk(cacheDir):
+        for filename in filenames:
+            if filename.endswith('.validators'):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size = stat.st_size + 256 # Counts the inode too, so 404 entries are not free
+            entries.append((stat.st_mtime, size, path))
+            totalBytes += size
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if totalBytes <= maxBytes:
+            break
+        for victim in (path, path[:-len('.png')] + '.validators') if path.endswith('.png') else (path,):
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
+        totalBytes -= size
+        evicted += 1
+    return evicted
+
+# A snapshot is one indexed region of a canvas on one date, for scans without any fetching or decoding.
+# Layout: the magic, the offset and length of the header (little-endian uint64s), the uint8 LUT indices row by row
+# from SNAPSHOT_DATA_OFFSET, then the header, a JSON object with the origin, size and palette of the region
+def snapshot_path(snapshotDir, canvas_id, iter_date):
+    return os.path.join(snapshotDir, f"{canvas_id}_{iter_date}.snap")
+
+# Creates a snapshot file of width x height indices and returns them memory-mapped for writing.
+# The file is sparse until the tiles are written in
+def create_snapshot(path, width, height):
+    with open(path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.truncate(SNAPSHOT_DATA_OFFSET + width * height)
+    return np.memmap(path, dtype=np.uint8, mode='r+', offset=SNAPSHOT_DATA_OFFSET, shape=(height, width))
+
+# Flushes the indices of a snapshot and appends its header
+def finish_snapshot(path, canvasImage, header):
+    canvasImage.flush()
+    headerBytes = json.dumps(header).encode()
+    headerOffset = SNAPSHOT_DATA_OFFSET + canvasImage.size
+    with open(path, 'r+b') as f:
+        f.seek(headerOffset)
+        f.write(headerBytes)
+        f.seek(len(SNAPSHOT_MAGIC))
+        f.write(headerOffset.to_bytes(8, 'little') + len(headerBytes).to_bytes(8, 'little'))
+
+# Opens a snapshot read-only. Returns its header and its indices memory-mapped, every process that opens
+# the same snapshot shares one page cache copy of them
+def open_snapshot(path):
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        headerOffset = int.from_bytes(f.read(8), 'little')
+        headerLength = int.from_bytes(f.read(8), 'little')
+        if headerOffset == 0:
+            raise ValueError(f"{path} is an unfinished snapshot")
+        f.seek(headerOffset)
+        header = json.loads(f.read(headerLength))
+    if header['colors'] != SEARCHABLE_COLORS_RGB:
+        raise ValueError(f"{path} was made with another palette, import it again")
+    canvasImage = np.memmap(path, dtype=np.uint8, mode='r', offset=SNAPSHOT_DATA_OFFSET, shape=(header['height'], header['width']))
+    return header, canvasImage
+
+# Builds (and caches) a table that maps every packed 24-bit BGR key to its LUT index
+def get_palette_table(lut):
+    cacheKey = frozenset(lut.items())
+    table = palette_table_cache.get(cacheKey)
+    if table is None:
+        table = np.full(1 << 24, UNKNOWN_COLOR_INDEX, dtype=np.uint8) # Anything not in the palette is flagged
+        for color_tuple, index in lut.items():
+            table[pack_colors(np.array(color_tuple, dtype=np.uint8))] = index
+        palette_table_cache[cacheKey] = table
+    return table
+
+# Packs each BGR pixel into one integer key (B << 16 | G << 8 | R)
+def pack_colors(image):
+    keys = image[..., 0].astype(np.uint32) << 16
+    keys |= image[..., 1].astype(np.uint32) << 8
+    keys |= image[..., 2]
+    return keys
 
 def convert_to_indexed(image, lut):
 
-    # Create an indexed image with the same shape as the input image
-    H, W, _ = image.shape
-    indexed_image = np.zeros((H, W), dtype=np.uint8)
+    # Maps every pixel to its LUT index in a single vectorized pass.
+    # Pixels that are not in the palette become UNKNOWN_COLOR_INDEX instead of 0 ("White")
+    table = get_palette_table(lut)
+    return table[pack_colors(image[..., :3])]
+
+# Builds the Look-Up Table (BGR tuple -> palette index) used for indexing
+def build_lut(colors_BGR):
+    lut = {}
+    for index, color in enumerate(colors_BGR):
+        lut[tuple(int(channel) for channel in color)] = index
+    return lut
+
+# The LUT of the searchable colors, every tile is indexed with it
+SEARCHABLE_LUT = build_lut([np.array(color[::-1], dtype=np.uint8) for color in SEARCHABLE_COLORS_RGB])
+
+# The LUT index of the background color of a canvas (its first color)
+def background_index(canvas):
+    return SEARCHABLE_LUT.get(tuple(canvas['colors'][0][::-1]), UNKNOWN_COLOR_INDEX)
+
+# Decodes a tile PNG into a uint8 array of LUT indices, plus a mask of its opaque pixels (None if fully opaque).
+# Palette PNGs (what pixelplanet backups are) are remapped through their PLTE, so no RGB image is ever built.
+# The seconds spent decoding the PNG and indexing its colors are added to timings ('decode' and 'index')
+def decode_tile_indexed(data, lut, timings=None):
+    timer = time.perf_counter()
+    with PIL.Image.open(io.BytesIO(data)) as img:
+        if img.mode == 'P':
+            indices = np.asarray(img)
+            palette = np.array(img.getpalette('RGB') or [], dtype=np.uint8).reshape(-1, 3)
+            transparency = img.info.get('transparency')
+            decoded = time.perf_counter()
+
+            remap = np.full(256, UNKNOWN_COLOR_INDEX, dtype=np.uint8)
+            remap[:len(palette)] = convert_to_indexed(palette[:, ::-1], lut)
+            tile = remap[indices]
+            opaque = None
+            if transparency is not None:
+                alpha = np.full(256, 255, dtype=np.uint8)
+                if isinstance(transparency, int):
+                    alpha[transparency] = 0
+                else:
+                    alpha[:len(transparency)] = np.frombuffer(transparency, dtype=np.uint8)
+                opaque = alpha[indices] > 0
+        else:
+            pixels = np.asarray(img.convert('RGBA'))
+            decoded = time.perf_counter()
+            tile = convert_to_indexed(pixels[..., 2::-1], lut) # RGB -> BGR
+            opaque = pixels[..., 3] > 0
+            opaque = None if opaque.all() else opaque
+    if timings is not None:
+        timings['decode'] += decoded - timer
+        timings['index'] += time.perf_counter() - decoded
+    return tile, opaque
+
+# Writes an indexed tile into the megachunk index buffer at (offx, offy), clipping it to the buffer
+def paste_indexed(canvasImage, tile, offx, offy, opaque=None):
+    H, W = canvasImage.shape
+    th, tw = tile.shape
+    x0, y0 = max(offx, 0), max(offy, 0)
+    x1, y1 = min(offx + tw, W), min(offy + th, H)
+    if x0 >= x1 or y0 >= y1:
+        return
+    src = tile[y0 - offy:y1 - offy, x0 - offx:x1 - offx]
+    if opaque is None:
+        canvasImage[y0:y1, x0:x1] = src
+    else:
+        np.copyto(canvasImage[y0:y1, x0:x1], src, where=opaque[y0 - offy:y1 - offy, x0 - offx:x1 - offx])
+
+# Compiles a template (its foreground as a boolean array) into the offsets the exact matcher tests.
+# The first foreground pixel is the anchor that decides which color every position is tested for,
+# the other pixels are (dy, dx, sameColor) checks against it.
+# The foreground is also split into (y0, y1, x0, x1) rectangles for the tolerant matcher (see match_template_approx)
+def compile_template(name, foreground):
+    foreground = np.ascontiguousarray(foreground, dtype=bool)
+    fgOffsets = [(int(dy), int(dx)) for dy, dx in zip(*np.nonzero(foreground))]
+    bgOffsets = [(int(dy), int(dx)) for dy, dx in zip(*np.nonzero(~foreground))]
+    if not fgOffsets or not bgOffsets:
+        return CompiledTemplate(name, foreground, None, [], []) # A one-colored template never correlates
 
-    # Use broadcasting and vectorized approach to find matching BGR values
-    for color_tuple, index in lut.items():
-        mask = np.all(image == color_tuple, axis=-1)  # Create a mask for pixels matching the color tuple
-        indexed_image[mask] = index  # Assign the index to matching pixels
-    return indexed_image
+    anchorY, anchorX = fgOffsets[0]
+    checks = [(dy, dx, False) for dy, dx in bgOffsets] + [(dy, dx, True) for dy, dx in fgOffsets[1:]]
+    checks.sort(key=lambda check: abs(check[0] - anchorY) + abs(check[1] - anchorX)) # Neighbours reject the most positions first
+
+    # Runs of foreground pixels in every row, a run with the same columns as one in the row above extends it
+    rectangles = []
+    openRuns = {} # (x0, x1) -> y0
+    for dy in range(foreground.shape[0] + 1):
+        runs = set()
+        if dy < foreground.shape[0]:
+            row = np.concatenate(([False], foreground[dy], [False]))
+            edges = np.flatnonzero(row[1:] != row[:-1])
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        for run in [run for run in openRuns if run not in runs]:
+            rectangles.append((openRuns.pop(run), dy) + run)
+        for run in runs:
+            openRuns.setdefault(run, dy)
+    return CompiledTemplate(name, foreground, (anchorY, anchorX), checks, sorted(rectangles))
+
+# The (foreground mismatches, background conflicts) a template is matched with, from the (maxMismatches, maxConflicts)
+# tolerance. Both are capped below half of the foreground and background, so a uniform area never matches
+# and a position can only match in the one color most of the foreground has
+def template_tolerance(template, tolerance):
+    fgCount = int(np.count_nonzero(template.foreground))
+    bgCount = template.foreground.size - fgCount
+    return min(tolerance[0], (fgCount - 1) // 2), min(tolerance[1], max(bgCount - 1, 0) // 2)
+
+# Rotated and mirrored versions of a template foreground, with the suffix added to their name
+def template_variants(foreground):
+    for mirrored in (False, True):
+        base = np.fliplr(foreground) if mirrored else foreground
+        for turns in range(4):
+            if mirrored or turns:
+                suffix = (" Mirrored" if mirrored else "") + (f" Rot{turns * 90}" if turns else "")
+                yield suffix, np.rot90(base, turns)
+
+# Loads and compiles every template in the directory. The result is cached per process and keyed on the
+# hashes of the template files, so calling this for every megachunk only re-reads the (tiny) files.
+# With variants, the rotated and mirrored versions of every template are added too (duplicates are skipped,
+# so e.g. a ReverseSwastika file just keeps its own name)
+def load_templates(directory='./templates', variants=False):
+    rePattern = re.compile(r's.*_.*\.(png|jpe?g)', re.IGNORECASE)
+    files = []
+    for filename in sorted(os.listdir(directory)):
+        if rePattern.fullmatch(filename):
+            with open(os.path.join(directory, filename), 'rb') as templateFile:
+                data = templateFile.read()
+            files.append((filename, hashlib.sha1(data).hexdigest(), data))
+
+    cacheKey = (os.path.abspath(directory), variants, tuple((filename, digest) for filename, digest, _ in files))
+    templates = template_cache.get(cacheKey)
+    if templates is not None:
+        return templates
+
+    foregrounds = []
+    for filename, _, data in files:
+        tempImg = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if tempImg is not None:
+            swasName = filename.split('_', 1)[1].replace('.png', '')
+            foregrounds.append((swasName, cv2.cvtColor(tempImg, cv2.COLOR_BGR2GRAY) < 128)) # The black design of the template
+    if variants:
+        for swasName, foreground in list(foregrounds):
+            foregrounds.extend((swasName + suffix, variant) for suffix, variant in template_variants(foreground))
+
+    templates = []
+    seen = set()
+    for swasName, foreground in foregrounds:
+        key = (foreground.shape, np.packbits(foreground).tobytes())
+        if key not in seen:
+            seen.add(key)
+            templates.append(compile_template(swasName, foreground))
+
+    template_cache.clear() # Only the current template set is worth keeping
+    template_cache[cacheKey] = templates
+    return templates
+
+# Finds every exact match of a compiled template in an indexed megachunk, for all colors at once.
+# A match is a position where all foreground pixels of the template share one color and none of its
+# background pixels have that color (what TM_CCOEFF_NORMED == 1 meant on the per-color masks).
+# allowedColors (a boolean per LUT index) restricts the colors that are tested.
+# Returns the X's and Y's of the matches (top left, relative to the megachunk) and the LUT index of their color
+def match_template_exact(canvasImage, template, allowedColors=None):
+    H, W = canvasImage.shape
+    th, tw = template.foreground.shape
+    outH, outW = H - th + 1, W - tw + 1
+    empty = np.empty(0, dtype=np.intp)
+    if outH <= 0 or outW <= 0 or template.anchor is None:
+        return empty, empty, empty.astype(np.uint8)
+
+    anchorY, anchorX = template.anchor
+    checks = template.checks
+
+    # The first checks run over the whole megachunk (they throw away uniform areas), ...
+    colors = canvasImage[anchorY:anchorY + outH, anchorX:anchorX + outW]
+    viable = colors != UNKNOWN_COLOR_INDEX
+    denseChecks = 2
+    for dy, dx, sameColor in checks[:denseChecks]:
+        shifted = canvasImage[dy:dy + outH, dx:dx + outW]
+        viable &= (shifted == colors) if sameColor else (shifted != colors)
+
+    # ... then only the surviving positions are tested, as flat indices into the megachunk
+    positions = np.flatnonzero(viable)
+    positions = (positions // outW) * W + (positions % outW)
+    flatCanvas = canvasImage.ravel()
+    colors = flatCanvas[positions + (anchorY * W + anchorX)]
+    if allowedColors is not None: # Cheaper on the survivors than on the whole megachunk
+        keep = allowedColors[colors]
+        positions = positions[keep]
+        colors = colors[keep]
+    for dy, dx, sameColor in checks[denseChecks:]:
+        if positions.size == 0:
+            break
+        shifted = flatCanvas[positions + (dy * W + dx)]
+        keep = (shifted == colors) if sameColor else (shifted != colors)
+        positions = positions[keep]
+        colors = colors[keep]
+
+    return positions % W, positions // W, colors
+
+# Finds every match of a compiled template in one color, allowing up to maxMismatches foreground pixels of another
+# color and up to maxConflicts background pixels of that color, from the summed-area table of the color
+# (cv2.integral of its mask over the megachunk) and the box counts of the mask (see color_box_counts).
+# Only anchors inside region ((y0, y1, x0, x1) of the megachunk) are tested. The pixels of the color in the template box
+# throw most positions away, the foreground rectangles are only summed on the rest (four corners of the summed-area
+# table each), so the cost does not depend on the tolerance.
+# Returns the X's and Y's of the matches (top left, relative to the megachunk) and their mismatch and conflict counts
+def match_template_approx(integral, boxCounts, template, maxMismatches, maxConflicts, region):
+    H, W = integral.shape[0] - 1, integral.shape[1] - 1
+    th, tw = template.foreground.shape
+    y0, y1, x0, x1 = region
+    y1, x1 = min(y1, H - th + 1), min(x1, W - tw + 1)
+    empty = np.empty(0, dtype=np.intp)
+    if y1 <= y0 or x1 <= x0 or template.anchor is None:
+        return empty, empty, empty, empty
+    fgCount = int(np.count_nonzero(template.foreground))
+
+    viable = cv2.inRange(boxCounts[y0:y1, x0:x1], fgCount - maxMismatches, fgCount + maxConflicts)
+    positions = np.flatnonzero(viable.view(bool)) # 0 or 255, np.flatnonzero is several times faster on bool
+    ys, xs = positions // (x1 - x0) + y0, positions % (x1 - x0) + x0
+
+    flatIntegral = integral.ravel()
+    corners = ys * (W + 1) + xs
+    fgHits = np.zeros(positions.size, dtype=np.int64)
+    for ry0, ry1, rx0, rx1 in template.rectangles:
+        fgHits += flatIntegral[corners + (ry1 * (W + 1) + rx1)] - flatIntegral[corners + (ry0 * (W + 1) + rx1)] - flatIntegral[corners + (ry1 * (W + 1) + rx0)] + flatIntegral[corners + (ry0 * (W + 1) + rx0)]
+    mismatches = fgCount - fgHits
+    conflicts = boxCounts[ys, xs] - fgHits
+    keep = (mismatches <= maxMismatches) & (conflicts <= maxConflicts)
+    return xs[keep], ys[keep], mismatches[keep], conflicts[keep]
+
+# Pixels of a color in the th x tw box at every position of its mask (top left anchored), for match_template_approx
+def color_box_counts(mask, th, tw):
+    return cv2.boxFilter(mask, cv2.CV_16U, (tw, th), anchor=(0, 0), normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+# Creates the shared memory slabs the megachunks are decoded into, and a free list holding their names.
+# Fetchers take a slab from the free list, workers put it back once they have scanned it
+def create_slab_pool(slabCount, slabSize):
+    slabs = {}
+    free_slabs = PROCESS_CONTEXT.Queue()
+    for _ in range(slabCount):
+        slab = shared_memory.SharedMemory(create=True, size=slabSize)
+        slabs[slab.name] = slab
+        free_slabs.put(slab.name)
+    return slabs, free_slabs
+
+# Frees the shared memory of every slab (only the process that created them does this)
+def destroy_slab_pool(slabs):
+    for slab in slabs.values():
+        slab.close()
+        slab.unlink()
+
+# Waits for a free slab without blocking the event loop
+async def acquire_slab(free_slabs):
+    while True:
+        try:
+            return free_slabs.get_nowait()
+        except Empty:
+            await asyncio.sleep(0.01)
+
+# Gives a (h, w) index buffer view of a slab. Workers attach each slab once and keep it attached
+def slab_view(slabs, slabName, h, w):
+    slab = slabs.get(slabName)
+    if slab is None:
+        slab = shared_memory.SharedMemory(name=slabName)
+        slabs[slabName] = slab
+    return np.ndarray((h, w), dtype=np.uint8, buffer=slab.buf)
+
+# A piece of the scanned region. Tiles are fetched for (x, y, w, h): the coreW x coreH core plus a halo of the largest
+# template size minus one to the right and below (clipped to the region). Only matches anchored in the core are kept,
+# so every position of the region is checked exactly once, also by templates that straddle two units
+WorkUnit = collections.namedtuple('WorkUnit', ['number', 'x', 'y', 'w', 'h', 'coreW', 'coreH'])
+
+# The scan of one canvas on one date: its run in the results database, the (x, y, w, h) region and the units it has left.
+# A run scans one job, a sweep many of them through the same workers and fetcher
+ScanJob = collections.namedtuple('ScanJob', ['runId', 'canvas_id', 'canvas', 'date', 'region', 'units'])
+
+# Detections of one symbol: the (x0, y0, x1, y1) box (x1 and y1 excluded) of their template windows, the detections
+# themselves as (x, y, color, template, mismatches, conflicts), and the templates and colors they were found with
+DetectionCluster = collections.namedtuple('DetectionCluster', ['x0', 'y0', 'x1', 'y1', 'hits', 'templates', 'colors'])
+
+# Where the units of a region start along one axis: every unitSize pixels from start, or with a gridOrigin on the lines
+# gridOrigin + k * unitSize, the first unit being cut short to end on one
+def unit_starts(start, length, unitSize, gridOrigin=None):
+    if gridOrigin is None or length <= 0:
+        return list(range(start, start + length, unitSize))
+    return [start] + list(range(start + ((gridOrigin - start) % unitSize or unitSize), start + length, unitSize))
+
+# Cuts the region into work units of unitSize x unitSize (plus their halo). With the tileOrigin of the canvas (where its
+# tile grid starts), the unit borders are on tile borders, so a unit only reaches into other tiles through its halo
+def plan_work_units(start_x, start_y, width, height, unitSize, haloX, haloY, tileOrigin=None):
+    units = []
+    rows = unit_starts(start_y, height, unitSize, tileOrigin) + [start_y + height]
+    columns = unit_starts(start_x, width, unitSize, tileOrigin) + [start_x + width]
+    for y, nextY in zip(rows, rows[1:]):
+        for x, nextX in zip(columns, columns[1:]):
+            coreW, coreH = nextX - x, nextY - y
+            w = min(coreW + haloX, start_x + width - x) # Avoid going beyond the region width
+            h = min(coreH + haloY, start_y + height - y) # Avoid going beyond the region height
+            units.append(WorkUnit(len(units) + 1, x, y, w, h, coreW, coreH))
+    return units
+
+# Number of canvas tiles a unit (with its halo) is fetched from, for a canvas whose tile grid starts at tileOrigin
+def unit_tile_count(unit, tileOrigin):
+    columns = (unit.x + unit.w - 1 - tileOrigin) // 256 - (unit.x - tileOrigin) // 256 + 1
+    rows = (unit.y + unit.h - 1 - tileOrigin) // 256 - (unit.y - tileOrigin) // 256 + 1
+    return columns * rows
+
+# Picks the unit size (a multiple of the 256 pixel tiles) of the (x, y, width, height) region with the shortest expected
+# scan, among those whose slabs (one per worker and per concurrent fetch, see create_slab_pool) fit in the memory budget.
+# Every unit is fetched and decoded with the extra tile row and column its halo reaches into, so the cost counts the
+# tiles of the planned units: the larger of all the tiles fetched and of what the busiest worker gets (the units handed
+# out largest first, each to the least busy worker) times the workers
+def choose_unit_size(x, y, width, height, workerCount, slabCount, memoryBudget, haloX, haloY, tileOrigin):
+    unitSize, bestCost = 256, None
+    for candidate in range(256, 4096 + 1, 256):
+        if candidate > 256 and slabCount * (candidate + max(haloX, haloY)) ** 2 > memoryBudget:
+            break
+        tiles = sorted((unit_tile_count(unit, tileOrigin) for unit in plan_work_units(x, y, width, height, candidate, haloX, haloY, tileOrigin)), reverse=True)
+        loads = [0] * workerCount
+        for unitTiles in tiles:
+            heapq.heapreplace(loads, loads[0] + unitTiles)
+        cost = max(sum(tiles), max(loads) * workerCount)
+        if bestCost is None or cost < bestCost:
+            unitSize, bestCost = candidate, cost
+    return unitSize
+
+# Expected scan cost of every work unit. With a snapshot it is the number of its tiles that are not all one color
+# (uniform ones cost next to nothing, see prescan_megachunk), read from the snapshot with one cheap pass. Otherwise
+# it is its tile count, as nothing is known about the backups before they are fetched
+def estimate_unit_costs(units, snapshot=None):
+    costs = []
+    for unit in units:
+        tileCount = -(-unit.coreW // 256) * -(-unit.coreH // 256)
+        if snapshot is None:
+            costs.append(tileCount)
+            continue
+        header, snapshotImage = snapshot
+        core = snapshotImage[unit.y - header['y']:unit.y - header['y'] + unit.coreH, unit.x - header['x']:unit.x - header['x'] + unit.coreW]
+        busyTiles = 0
+        for tileY in range(0, unit.coreH, 256):
+            for tileX in range(0, unit.coreW, 256):
+                lowest, highest, _, _ = cv2.minMaxLoc(core[tileY:tileY + 256, tileX:tileX + 256])
+                busyTiles += lowest != highest
+        costs.append(1 + busyTiles)
+    return costs
+
+# Splits the work units over shardCount nodes, balanced on their expected costs: the costliest unit left goes to the
+# least loaded shard (ties go to the lowest unit number and shard index), so every node computes the same split on
+# its own. Returns the units of every shard and their total costs
+def partition_units(units, costs, shardCount):
+    shards = [[] for _ in range(shardCount)]
+    loads = [0] * shardCount
+    for cost, unit in sorted(zip(costs, units), key=lambda item: (-item[0], item[1].number)):
+        shard = min(range(shardCount), key=lambda index: (loads[index], index))
+        shards[shard].append(unit)
+        loads[shard] += cost
+    return [sorted(shard) for shard in shards], loads
+
+# Parses the i/N of --shard (i from 1 to N)
+def shard_spec(text):
+    match = re.fullmatch(r'(\d+)/(\d+)', text)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"{text} is not a shard like 1/4")
+    return int(match.group(1)), int(match.group(2))
+
+# Parses a --dates range, FROM:TO or a single date (YYYYMMDD), into the list of its dates
+def date_range(text):
+    try:
+        first, _, last = text.partition(':')
+        first = datetime.datetime.strptime(first, "%Y%m%d").date()
+        last = datetime.datetime.strptime(last, "%Y%m%d").date() if last else first
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text} is not a date range like 20250401:20250407")
+    if last < first:
+        raise argparse.ArgumentTypeError(f"{text} ends before it starts")
+    return [first + datetime.timedelta(days=day) for day in range((last - first).days + 1)]
+
+# Parses the X0,Y0,X1,Y1 region of --query (X1 and Y1 excluded)
+def box_spec(text):
+    match = re.fullmatch(r'(-?\d+),(-?\d+),(-?\d+),(-?\d+)', text)
+    if match is None or int(match.group(3)) <= int(match.group(1)) or int(match.group(4)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"{text} is not a region like 30000,30000,31000,31000")
+    return tuple(int(group) for group in match.groups())
+
+# Parses the X,Y[,K] of --nearest
+def nearest_spec(text):
+    match = re.fullmatch(r'(-?\d+),(-?\d+)(?:,(\d+))?', text)
+    if match is None or match.group(3) == '0':
+        raise argparse.ArgumentTypeError(f"{text} is not a point like 30000,30000 or 30000,30000,5")
+    return int(match.group(1)), int(match.group(2)), int(match.group(3) or 1)
 
 # Gets the megachunk
-async def fetch_megachunk(canvas_id, canvas, x, y, w, h, start_date, taskNumber, searchable_colors_BGR, swastikas_swas, swastikas_name, display_length, batchSize, queue):
+async def fetch_megachunk(fetcher, canvas_id, canvas, unit, start_date, queue, slabs, free_slabs, fallbackDays=1, results_queue=None, runId=None):
+    taskNumber, x, y, w, h = unit.number, unit.x, unit.y, unit.w, unit.h
     print(f"Loading mega-chunk #{taskNumber} at ({x}, {y}) with width {w} and height {h}...")
     
     canvas_size = canvas["size"] # The size of the megachunk
-    bkg = tuple(canvas['colors'][0]) # The background color
+    bkg = background_index(canvas)
     iter_date = start_date.strftime("%Y%m%d") # The date e.g. 20250408
+    fetchDates = fallback_dates(start_date, fallbackDays)
 
     # Calculates the chunk to get
     offset = int(-canvas_size / 2)
     xc = (x - offset) // 256
-    wc = (x + w - offset) // 256
+    wc = (x + w - 1 - offset) // 256 # The last tile the unit reaches into
     yc = (y - offset) // 256
-    hc = (y + h - offset) // 256
+    hc = (y + h - 1 - offset) // 256
 
     if not ((offset <= y < offset*-1) and (offset <= x < offset*-1)):
         print(f"WARNING: Mega-chunk #{taskNumber} at ({x}, {y}) is out of bounds! Skipping...")
+        if results_queue is not None:
+            results_queue.put(('scanned', runId, taskNumber, [])) # Nothing to find there, the work ledger counts it as written
         return
 
     # Calls and loads the chunk
     tasks = []
-    async with aiohttp.ClientSession() as session:
 
-        #print(f"Fetching megachunk #{taskNumber}...")
-        # Gets megachunk
-        image = PIL.Image.new('RGBA', (w, h)) # Fallback. If neither day loads, it matches on a blank megchunk
+    #print(f"Fetching megachunk #{taskNumber}...")
+    # Gets megachunk
+    profile = collections.Counter() # Run profile of the megachunk, the worker adds the match side
+    slab_timer_start = time.perf_counter()
+    slabName = await acquire_slab(free_slabs) # Waits here when every slab is in use (the workers are behind)
+    profile['slabWait'] = time.perf_counter() - slab_timer_start
+    canvasImage = slab_view(slabs, slabName, h, w) # Preallocated index buffer the tiles are decoded into
+    canvasImage.fill(UNKNOWN_COLOR_INDEX)
+    try:
+        tileKeys = []
         for iy in range(yc, hc + 1):
             for ix in range(xc, wc + 1):
-                url = '%s/%s/%s/%s/%s/tiles/%s/%s.png' % (PPFUN_STORAGE_URL, iter_date[0:4], iter_date[4:6], iter_date[6:], canvas_id, ix, iy)
-                #print(f"Attempting GET at {url}")
                 offx = ix * 256 + offset - x
                 offy = iy * 256 + offset - y
-                tasks.append(fetch_chunk(session, url, offx, offy, image, bkg, True))
-        await asyncio.gather(*tasks)
+                tileKeys.append(f"{ix},{iy}")
+                tasks.append(fetch_chunk(fetcher, canvas_id, fetchDates, ix, iy, offx, offy, canvasImage, SEARCHABLE_LUT, bkg, profile))
+        fetch_timer_start = time.perf_counter()
+        tileDates = dict(zip(tileKeys, await asyncio.gather(*tasks))) # Which date every tile came from
+        profile['fetch'] = time.perf_counter() - fetch_timer_start
+    except:
+        free_slabs.put(slabName) # The slab is not going to a worker, so it is recycled here
+        raise
 
-        # check if image is all just one color to lazily detect if whole full backup was 404
-        clr = image.getcolors(1)
-        if clr is not None:
-            tasks = []
+    fallenBack = sum(1 for tileDate in tileDates.values() if tileDate is not None and tileDate != iter_date)
+    missing = sum(1 for tileDate in tileDates.values() if tileDate is None)
+    profile.update(tiles=len(tileDates), tilesFallenBack=fallenBack, tilesMissing=missing)
+    if fallenBack:
+        print(f"Megachunk #{taskNumber} at ({x}, {y}) took {fallenBack} of its {len(tileDates)} tiles from earlier dates")
+    if missing == len(tileDates):
+        print(f"WARNING: Megachunk #{taskNumber} at ({x}, {y}) has no tiles on any date from {fetchDates[-1]} to {fetchDates[0]}, it is blank")
+    del canvasImage
+    if results_queue is not None:
+        results_queue.put(('fetched', runId, taskNumber, None)) # For the work ledger
+    queue.put((runId, unit, slabName, canvas_id, canvas_size, iter_date, tileDates, dict(profile, queuedAt=time.time()))) # Only the slab handle and where it is, the workers have their own templates
+    print(f"Loaded megachunk #{taskNumber} into the queue")
 
-            print(f"Megachunk #{taskNumber} at ({x}, {y}) for today (the {int(iter_date[6:])}th) is faulty, using yesterday's (the {int(iter_date[6:])-1}th) megachunk instead.")
-            
-            # Rolls back the date 1 day
-            iter_date = iter_date[:6] + str(int(iter_date[6:])-1).zfill(2)
-            
-            for iy in range(yc, hc + 1):
-                for ix in range(xc, wc + 1):
-                    url = '%s/%s/%s/%s/%s/tiles/%s/%s.png' % (PPFUN_STORAGE_URL, iter_date[0:4], iter_date[4:6], iter_date[6:], canvas_id, ix, iy)
-                    #print(f"Attempting GET at {url}")
-                    offx = ix * 256 + offset - x
-                    offy = iy * 256 + offset - y
-                    tasks.append(fetch_chunk(session, url, offx, offy, image, bkg, True))
-            await asyncio.gather(*tasks)
-        queue.put((taskNumber, searchable_colors_BGR, image, swastikas_swas, swastikas_name, display_length, canvas_id, x, y))
-        print(f"Loaded megachunk #{taskNumber} into the queue")
-        #image.close()
-
-async def image_processing(processName, taskNumber, searchable_colors_BGR, image, swastikas_swas, swastikas_name, display_length, canvas_id, x, y):
-    print(f"{processName} mapping LUT of megachunk #{taskNumber}")
+# Matches every template over the anchors inside the regions ((y0, y1, x0, x1) rectangles of the megachunk,
+# all of it when regions is None). With a prescan (see prescan_megachunk), only the (color, template, block)
+# combinations the color histograms leave viable are matched, and the pruning is counted in stats.
+# With a (maxMismatches, maxConflicts) tolerance other than (0, 0), symbols with some griefed or stray pixels match too
+# (see match_template_approx), one color at a time so only one summed-area table is held at once.
+# Returns the matches as (color, templateNumber, y, x, mismatches, conflicts), relative to the megachunk
+def match_templates(canvasImage, templates, regions=None, prescan=None, stats=None, tolerance=(0, 0)):
+    H, W = canvasImage.shape
+    detections = set()
+    templateRegions = []
+    for template in templates:
+        pruned = [(y0, y1, x0, x1, None) for y0, y1, x0, x1 in (regions if regions is not None else [(0, H, 0, W)])]
+        if prescan is not None:
+            prune_timer_start = time.perf_counter()
+            pruned = prune_regions(prescan, template, pruned, stats, template_tolerance(template, tolerance)[0])
+            if stats is not None:
+                stats['pruneSeconds'] += time.perf_counter() - prune_timer_start
+        templateRegions.append(pruned)
 
-    processing_timer_start = time.time()
+    if tolerance == (0, 0):
+        for templateNumber, template in enumerate(templates):
+            th, tw = template.foreground.shape
+            # Positions where the template does not fit in the megachunk are left to the unit whose halo holds them
+            for y0, y1, x0, x1, allowedColors in templateRegions[templateNumber]:
+                # The crop also holds the pixels the templates anchored in the region reach into
+                swastika_Xs, swastika_Ys, colors = match_template_exact(canvasImage[y0:y1 + th - 1, x0:x1 + tw - 1], template, allowedColors)
+                inRegion = (swastika_Ys < y1 - y0) & (swastika_Xs < x1 - x0)
+                count = np.count_nonzero(inRegion)
+                detections.update(zip(colors[inRegion].tolist(), [templateNumber] * count, (swastika_Ys[inRegion] + y0).tolist(), (swastika_Xs[inRegion] + x0).tolist(), [0] * count, [0] * count))
+        return sorted(detections) # Same order as the old per-color matchTemplate loop: color, template, row, column
 
-    lut = {} # Custom Look-Up Table
+    # The masks, summed-area tables and box counts are only made over every region and the pixels the templates anchored
+    # in it reach into, so a small region of a large canvas (like the changed tiles of --watch) stays cheap
+    maxTh = max((template.foreground.shape[0] for template in templates), default=1)
+    maxTw = max((template.foreground.shape[1] for template in templates), default=1)
+    for ry0, ry1, rx0, rx1 in (regions if regions is not None else [(0, H, 0, W)]):
+        crop = canvasImage[ry0:ry1 + maxTh - 1, rx0:rx1 + maxTw - 1]
+        cropRegions = [[(y0 - ry0, y1 - ry0, x0 - rx0, x1 - rx0, allowedColors) for y0, y1, x0, x1, allowedColors in pruned if ry0 <= y0 and y1 <= ry1 and rx0 <= x0 and x1 <= rx1] for pruned in templateRegions]
+        for color in range(len(SEARCHABLE_COLORS_RGB)):
+            if prescan is not None and not prescan['histogram'][color]:
+                continue
+            mask, integral = None, None # Only made once some template region allows the color
+            boxCounts = {} # Per template size
+            for templateNumber, template in enumerate(templates):
+                maxMismatches, maxConflicts = template_tolerance(template, tolerance)
+                for y0, y1, x0, x1, allowedColors in cropRegions[templateNumber]:
+                    if allowedColors is not None and not allowedColors[color]:
+                        continue
+                    if integral is None:
+                        mask = (crop == color).view(np.uint8)
+                        integral = cv2.integral(mask)
+                    if template.foreground.shape not in boxCounts:
+                        boxCounts[template.foreground.shape] = color_box_counts(mask, *template.foreground.shape)
+                    swastika_Xs, swastika_Ys, mismatches, conflicts = match_template_approx(integral, boxCounts[template.foreground.shape], template, maxMismatches, maxConflicts, (y0, y1, x0, x1))
+                    detections.update(zip([color] * len(swastika_Xs), [templateNumber] * len(swastika_Xs), (swastika_Ys + ry0).tolist(), (swastika_Xs + rx0).tolist(), mismatches.tolist(), conflicts.tolist()))
+    return sorted(detections)
 
-    # Maps the LUT
-    for index, currentPalleteColor in enumerate(searchable_colors_BGR):
-        lut[tuple(currentPalleteColor)] = index
-    
-    lutColorDictionary = {
-        0: "White", 1: "Off-White", 2: "Silver", 3: "Gray", 4: "Dark Gray",
-        5: "Black", 6: "Lite Pink", 7: "More Pink", 8: "Hot Pink", 9: "Lipstick Red 1",
-        10: "Red", 11: "Dark Red", 12: "Dark Tan", 13: "Tangerine", 14: "Light Brown",
-        15: "Coffee", 16: "Light Tan", 17: "Light Yellow", 18: "Mustard Yellow", 19: "Lime",
-        20: "Green", 21: "Green Bean", 22: "Camo Green 1", 23: "Cloud Blue    ", 24: "Robin Egg Blue",
-        25: "Medium Blue 1", 26: "Blue", 27: "Bluejean", 28: "Lavener", 29: "Eggplant",
-        30: "Ugly Purple?", 31: "Purple-Red Mix", 32: "Lipstick Red 2", 33: "Trump Tan", 34: "Caution Yellow",
-        35: "Purple (Brown)", 36: "Chocholate", 37: "Milk Chocholate", 38: "Orange", 39: "Lapis Lazuli",
-        40: "TheBlueCorner", 41: "Medium Blue 2", 42: "Turquoise", 43: "Purple-Black 1", 44: "Purple-Black 2",
-        45: "Dark Purple", 46: "Purple", 47: "Light Purple", 48: "Dark Green", 49: "Camo Green 2",
-        50: "Grass Green 1", 51: "Grass Green 2", 52: "Light Green"
+# Pre-scan of a megachunk for match_templates: the color histogram of every PRUNE_BLOCK_SIZE block, summed over the
+# blocks a template anchored in it can reach (its right and lower neighbours, as far as the largest template goes)
+def prescan_megachunk(canvasImage, templates):
+    H, W = canvasImage.shape
+    size = PRUNE_BLOCK_SIZE
+    blocksY, blocksX = -(-H // size), -(-W // size)
+
+    # A megachunk of one color (usually blank canvas) can not hold any symbol, its blocks are not looked at
+    lowest, highest, _, _ = cv2.minMaxLoc(canvasImage)
+    if lowest == highest:
+        histogram = np.zeros(256, dtype=np.int64)
+        histogram[int(lowest)] = H * W
+        return {
+            'histogram': histogram,
+            'reachable': np.zeros((blocksY, blocksX, 256), dtype=np.int64),
+            'multicolored': np.zeros((blocksY, blocksX), dtype=bool)
+        }
+
+    histograms = np.empty((blocksY, blocksX, 256), dtype=np.int64)
+    for blockY in range(blocksY):
+        for blockX in range(blocksX):
+            block = canvasImage[blockY * size:(blockY + 1) * size, blockX * size:(blockX + 1) * size]
+            histograms[blockY, blockX] = cv2.calcHist([block], [0], None, [256], [0, 256]).ravel() # Much faster than np.bincount on uint8
+
+    # Sums every block with the next `reach` blocks to the right and below, through 2D prefix sums
+    reach = -(-(max((max(template.foreground.shape) for template in templates), default=1) - 1) // size)
+    prefix = np.zeros((blocksY + 1, blocksX + 1, 256), dtype=np.int64)
+    prefix[1:, 1:] = histograms.cumsum(0).cumsum(1)
+    rows, cols = np.arange(blocksY), np.arange(blocksX)
+    y1, x1 = np.minimum(rows + reach + 1, blocksY), np.minimum(cols + reach + 1, blocksX)
+    reachable = prefix[y1][:, x1] - prefix[rows][:, x1] - prefix[y1][:, cols] + prefix[rows][:, cols]
+
+    return {
+        'histogram': histograms.sum((0, 1)),
+        'reachable': reachable, # (blocksY, blocksX, 256) pixel counts
+        'multicolored': np.count_nonzero(reachable, axis=2) > 1 # A background pixel needs another color next to the symbol
     }
 
-    print(f"{processName} Loading canvas image for megachunk #{taskNumber}")
-    
-    # Call and load the images
-    bigCanvasImage = np.array(image)
-    bigCanvasImage = cv2.cvtColor(bigCanvasImage, cv2.COLOR_RGB2BGR)
-    canvasImage = convert_to_indexed(bigCanvasImage, lut) # Shrink it using the LUT
-    
-    canvasImage = np.uint8(canvasImage)
-
-    for currentColor in searchable_colors_BGR:
-        #print(f"{processName} Swapping color to {currentColor} for megachunk #{taskNumber}...")
-
-        # Converts the current color to the LUT index
-        currentColor = get_lut_index(lut, currentColor)
-
-        # Creates a (1 channel) mask where all matching current colors are black and non-matching are white
-        canvasImage_BW = cv2.inRange(canvasImage, currentColor, currentColor)
-
-        swastikas = zip(swastikas_swas, swastikas_name)
-        swastasks = []
-        for swastika, swastika_name in swastikas:
-            #print(f"{processName} swapping swastika to {swastika_name} for megachunk #{taskNumber}...")
-            swastika = convert_to_indexed(swastika, lut) # Convert the swastika template using the LUT
-
-            # If the template is larger than the megachunk, we just ignore the megachunk
-            if swastika.shape[0] < canvasImage.shape[0] and swastika.shape[1] < canvasImage.shape[1]:
-
-                # Stores all matches of all confidences of the black and white swastika to the black (which is actually the current color) and white (which is actually any other color) canvas
-                matchTemplateResult = cv2.matchTemplate(canvasImage_BW, swastika, cv2.TM_CCOEFF_NORMED)
-
-                # Debuging matching
-                #if matchTemplateResult is not None:
-                #    print(f'{swastika_name}: There are {len(np.where(matchTemplateResult >= -1)[0])} matches of any confidence')
-
-                threshold = 1
-                swastikaLocations = np.where(matchTemplateResult >= threshold)
-
-                if swastikaLocations[0].size > 0:
-                    processNumber = processName.split('-')[-1]
-                    print(f"{processName} writting in \'./swastikaList{processNumber}.txt\'")
-
-                    async with file_lock:
-                        with open(f"swastikaList{processNumber}.txt", "a") as swasList:
-                            for X_Y_Pair in zip(*swastikaLocations[::-1]):
-                                swastika_X, swastika_Y = X_Y_Pair # X & Y relative to the megachunk
-                                #cv2.imshow('Image', cv2.resize(canvasImage[swastika_Y-1:swastika_Y + 6, swastika_X-1:swastika_X + 6], (500, 500), interpolation=cv2.INTER_NEAREST))
-                                #cv2.waitKey(0)
-                                #cv2.destroyAllWindows()
-                                #print(f"{lutColorDictionary[currentColor]} - https://pixmap.fun/#{canvas_id},{swastika_X},{swastika_Y},36")
-                                detectedName = f"{lutColorDictionary[currentColor]} {swastika_name}"
-                                swasList.write(f"{detectedName:<{display_length}} - https://pixmap.fun/#{canvas_id},{swastika_X + x},{swastika_Y + y},36\n")
+# Splits the regions of a template into rectangles of PRUNE_BLOCK_SIZE blocks where some color appears at least as often
+# as the template has foreground pixels (less the maxMismatches it may have of other colors), with those colors
+# as the allowed ones. Everything else is pruned
+def prune_regions(prescan, template, regions, stats=None, maxMismatches=0):
+    size = PRUNE_BLOCK_SIZE
+    fgCount = int(np.count_nonzero(template.foreground)) - maxMismatches
+    colorCount = len(SEARCHABLE_COLORS_RGB)
+    viable = prescan['reachable'][:, :, :colorCount] >= fgCount
+    viable &= prescan['multicolored'][:, :, None]
+    if template.anchor is None:
+        viable[:] = False
+    viableBlocks = viable.any(2)
+
+    pruned = []
+    for y0, y1, x0, x1, _ in regions:
+        by0, by1, bx0, bx1 = y0 // size, -(-y1 // size), x0 // size, -(-x1 // size)
+        if stats is not None:
+            combinations = (by1 - by0) * (bx1 - bx0) * colorCount
+            stats['combinations'] += combinations
+            stats['prunedCombinations'] += combinations - int(np.count_nonzero(viable[by0:by1, bx0:bx1]))
+
+        # Runs of viable blocks in every block row. A run with the same columns as one in the row above extends it,
+        # so a fully viable region stays a single rectangle
+        rectangles = [] # (first block row, end block row, first block column, end block column)
+        openRuns = {} # (first block column, end block column) -> first block row
+        for blockY in range(by0, by1 + 1):
+            runs = set()
+            if blockY < by1:
+                row = np.concatenate(([False], viableBlocks[blockY, bx0:bx1], [False]))
+                edges = np.flatnonzero(row[1:] != row[:-1]) + bx0
+                runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+            for run in [run for run in openRuns if run not in runs]:
+                rectangles.append((openRuns.pop(run), blockY) + run)
+            for run in runs:
+                openRuns.setdefault(run, blockY)
+
+        # Every rectangle is cropped with its own halo, so splitting only pays off when most of the region goes away
+        area = sum((rby1 - rby0) * (rbx1 - rbx0) for rby0, rby1, rbx0, rbx1 in rectangles)
+        if area * 2 > (by1 - by0) * (bx1 - bx0):
+            rectangles = [(by0, by1, bx0, bx1)]
+        for rby0, rby1, rbx0, rbx1 in rectangles:
+            allowedColors = np.zeros(256, dtype=bool)
+            allowedColors[:colorCount] = viable[rby0:rby1, rbx0:rbx1].any((0, 1))
+            pruned.append((max(y0, rby0 * size), min(y1, rby1 * size), max(x0, rbx0 * size), min(x1, rbx1 * size), allowedColors))
+    return pruned
+
+# Lists the canvas tiles an anchor of the megachunk core can lie in, as (tx, ty, y0, y1, x0, x1) with the part of the
+# tile inside the core in megachunk coordinates
+def core_tiles(canvas_size, x, y, coreH, coreW):
+    offset = int(-canvas_size / 2)
+    for ty in range((y - offset) // 256, (y + coreH - 1 - offset) // 256 + 1):
+        y0, y1 = max(ty * 256 + offset - y, 0), min((ty + 1) * 256 + offset - y, coreH)
+        for tx in range((x - offset) // 256, (x + coreW - 1 - offset) // 256 + 1):
+            x0, x1 = max(tx * 256 + offset - x, 0), min((tx + 1) * 256 + offset - x, coreW)
+            yield tx, ty, y0, y1, x0, x1
+
+# Identifies a template set, so detections are only carried forward between runs with the same templates
+def templates_signature(templates):
+    signature = hashlib.sha1()
+    for template in templates:
+        signature.update(template.name.encode())
+        signature.update(repr(template.foreground.shape).encode())
+        signature.update(np.packbits(template.foreground).tobytes())
+    return signature.hexdigest()
+
+# Incremental version of match_templates. The state is kept per canvas tile (<stateDir>/<canvas>/<tx>_<ty>.json), so it
+# does not depend on how a run cut the region into megachunks: the hash of every pixel a template anchored in the tile
+# can cover (the tile plus the template-sized halo to its right and below) and the detections anchored in it.
+# Only the tiles whose hash changed since the previous scan are matched again, the detections of the others are
+# carried forward, so the result is the same as a full scan
+def match_templates_incremental(processName, taskNumber, canvasImage, templates, canvas_id, canvas_size, x, y, stateDir, coreH, coreW, prescan=None, stats=None, tolerance=(0, 0)):
+    H, W = canvasImage.shape
+    haloY = max((template.foreground.shape[0] for template in templates), default=1) - 1
+    haloX = max((template.foreground.shape[1] for template in templates), default=1) - 1
+    signature = templates_signature(templates)
+    templateNumbers = {template.name: templateNumber for templateNumber, template in enumerate(templates)}
+    os.makedirs(os.path.join(stateDir, str(canvas_id)), exist_ok=True)
+
+    tileCount = 0
+    carried = set()
+    stale = {} # (tx, ty) -> (state path, covered area, hash) of the tiles to match again
+    for tx, ty, y0, y1, x0, x1 in core_tiles(canvas_size, x, y, coreH, coreW):
+        tileCount += 1
+        statePath = os.path.join(stateDir, str(canvas_id), f"{tx}_{ty}.json")
+        # Canvas rectangles of the anchors and of the pixels they see, a different region or halo is a different state
+        area = [x + x0, y + y0, x + x1, y + y1, x + min(x1 + haloX, W), y + min(y1 + haloY, H)]
+        tileHash = hashlib.sha1(np.ascontiguousarray(canvasImage[y0:min(y1 + haloY, H), x0:min(x1 + haloX, W)])).hexdigest()
+        previous = None
+        try:
+            with open(statePath, 'r') as stateFile:
+                previous = json.load(stateFile)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"WARNING: {processName} could not read the state of tile {tx},{ty} ({e}), matching it again")
+        if previous is not None and previous.get('templates') == signature and previous.get('tolerance') == list(tolerance) and previous.get('area') == area and previous.get('hash') == tileHash:
+            carried.update((color, templateNumbers[name], cy - y, cx - x, mismatches, conflicts) for color, name, cx, cy, mismatches, conflicts in previous['detections'])
+        else:
+            stale[(tx, ty)] = (statePath, area, tileHash)
+
+    matched = match_templates(canvasImage, templates, [(area[1] - y, area[3] - y, area[0] - x, area[2] - x) for _, area, _ in stale.values()], prescan, stats, tolerance) if stale else []
+    if len(stale) < tileCount:
+        print(f"{processName} re-matched {len(stale)} of {tileCount} tiles of megachunk #{taskNumber} and carried {len(carried)} detections forward")
+    if stats is not None:
+        stats['tilesMatched'] += len(stale)
+        stats['tilesCarried'] += tileCount - len(stale)
+
+    offset = int(-canvas_size / 2)
+    tileDetections = {key: [] for key in stale}
+    for color, templateNumber, dy, dx, mismatches, conflicts in matched:
+        tileDetections[((x + dx - offset) // 256, (y + dy - offset) // 256)].append((color, templates[templateNumber].name, x + dx, y + dy, mismatches, conflicts))
+    for key, (statePath, area, tileHash) in stale.items():
+        temporaryPath = f"{statePath}.{os.getpid()}.tmp" # Own name per process, no other worker can truncate it
+        with open(temporaryPath, 'w') as stateFile:
+            json.dump({'templates': signature, 'tolerance': list(tolerance), 'area': area, 'hash': tileHash, 'detections': tileDetections[key]}, stateFile)
+        os.replace(temporaryPath, statePath)
+    return sorted(carried | set(matched))
+
+def image_processing(processName, taskNumber, canvasImage, templates, results_queue, canvas_id, x, y, canvas_size=None, stateDir=None, iter_date=None, tileDates=None, core=None, prune=True, stats=None, profile=None, tolerance=(0, 0), runId=None):
+    print(f"{processName} scanning megachunk #{taskNumber}")
+
+    processing_timer_start = time.time()
+    stats = stats if stats is not None else collections.Counter()
+    profile = profile if profile is not None else {}
+
+    # The megachunk already arrives as LUT indices (see decode_tile_indexed).
+    # The pre-scan histograms tell which colors are worth matching where
+    stage_timer_start = time.perf_counter()
+    prescan = prescan_megachunk(canvasImage, templates) if prune else None
+    prescanSeconds = time.perf_counter() - stage_timer_start
+    unknownPixels = prescan['histogram'][UNKNOWN_COLOR_INDEX] if prune else np.count_nonzero(canvasImage == UNKNOWN_COLOR_INDEX)
+    if unknownPixels > 0:
+        print(f"WARNING: {processName} found {unknownPixels} pixels in megachunk #{taskNumber} that are not in the palette")
+
+    # Finds the exact (or, with a tolerance, nearly exact) matches of every template
+    # Only the matches anchored in the core are kept, the halo belongs to the cores of the next units
+    coreH, coreW = core if core is not None else canvasImage.shape
+    if prune and np.count_nonzero(prescan['histogram']) <= 1:
+        stats['emptyMegachunks'] += 1 # One color, nothing can match
+    pruneSeconds = stats['pruneSeconds']
+    stage_timer_start = time.perf_counter()
+    if stateDir is None:
+        detections = match_templates(canvasImage, templates, [(0, coreH, 0, coreW)], prescan, stats, tolerance)
+    else:
+        detections = match_templates_incremental(processName, taskNumber, canvasImage, templates, canvas_id, canvas_size, x, y, stateDir, coreH, coreW, prescan, stats, tolerance)
+    pruneSeconds = stats['pruneSeconds'] - pruneSeconds # The pruning of every template, inside match_templates
+    profile['prune'] = prescanSeconds + pruneSeconds
+    profile['match'] = time.perf_counter() - stage_timer_start - pruneSeconds
+
+    # One batch per megachunk to the results collector (also when it is empty, it marks the unit as written in the work ledger),
+    # with canvas coordinates and the date of the tile of every match
+    records = []
+    for currentColor, templateNumber, swastika_Y, swastika_X, mismatches, conflicts in detections: # X & Y relative to the megachunk
+        sourceDate = iter_date
+        if tileDates:
+            offset = int(-canvas_size / 2)
+            sourceDate = tileDates.get(f"{(swastika_X + x - offset) // 256},{(swastika_Y + y - offset) // 256}", iter_date)
+        records.append((canvas_id, swastika_X + x, swastika_Y + y, currentColor, templates[templateNumber].name, sourceDate, taskNumber, mismatches, conflicts))
+    stage_timer_start = time.perf_counter()
+    results_queue.put(('scanned', runId, taskNumber, records))
+    profile['write'] = time.perf_counter() - stage_timer_start
+    profile['detections'] = len(records)
+    if records:
+        print(f"{processName} sent {len(records)} detections to the results collector")
     processing_timer_end = time.time()
     processing_time = processing_timer_end - processing_timer_start
     print(f"{processName} has finished scanning megachunk #{taskNumber} in {(processing_time / 60):.0f} minutes and {(processing_time % 60):02.0f} seconds")
 
-# Function to process the image in chunks
-async def process_image_in_chunks(canvas_id, canvas, start_x, start_y, image_width, image_height, start_date, chunk_size, queue):
-    tasks = []
-    swastikas_swas = []
-    swastikas_name = []
-    longest_name = 0
-    taskNumber = 0
-
-    semaphore = asyncio.Semaphore(4)
-    async def semaphoreMegaChunkProcessor(canvas_id, canvas, x, y, chunk_width, chunk_height, start_date, taskNumber, searchable_colors_BGR, swastikas_swas, swastikas_name, display_length, batch_size, queue):
-        async with semaphore:
-            return await fetch_megachunk(canvas_id, canvas, x, y, chunk_width, chunk_height, start_date, taskNumber, searchable_colors_BGR, swastikas_swas, swastikas_name, display_length, batch_size, queue)
-
-    # (Swastika) colors to look for
-    searchable_colors_RGB = [
-        # White to Black
-        [255, 255, 255], [228, 228, 228], [196, 196, 196], [136, 136, 136], [78, 78, 78], [0, 0, 0],
-        # Pink to Red
-        [244, 179, 174], [255, 167, 209], [255, 84, 178], [255, 101, 101], [229, 0, 0], [154, 0, 0],
-        # Orange to Brown
-        [254, 164, 96], [229, 149, 0], [160, 106, 66], [96, 64, 40],
-        # Tan to Yellow
-        [245, 223, 176], [255, 248, 137], [229, 217, 0],
-        # Light Green to Dark Green
-        [148, 224, 68], [2, 190, 1], [104, 131, 56], [0, 101, 19],
-        # Light Blue to Dark Blue
-        [202, 227, 255], [0, 211, 221], [0, 131, 199], [0, 0, 234], [25, 25, 115],
-        # Lavender to (Purple to) Light Red
-        [207, 110, 228], [130, 0, 128], [83, 39, 68], [125, 46, 78], [193, 55, 71],
-        # Orange to Orange
-        [214, 113, 55], [252, 154, 41],
-        # Dark Purple to Orange
-        [68, 33, 57], [131, 51, 33], [163, 61, 24], [223, 96, 22],
-        # Dark Blue to Light Blue
-        [31, 37, 127], [10, 79, 175], [10, 126, 230], [88, 237, 240],
-        # Dark Purple to Lavander
-        [37, 20, 51], [53, 33, 67], [66, 21, 100], [74, 27, 144], [110, 75, 237],
-        # Dark Green to Lime
-        [16, 58, 47], [16, 74, 31], [16, 142, 47], [16, 180, 47], [117, 215, 87]
-    ]
-
-    # Converts the RGB array to a BGR array
-    searchable_colors_BGR = [np.array(color[::-1], dtype=np.uint8) for color in searchable_colors_RGB]
-
-    # Finds and loads all templates as BGR images
-    rePattern = re.compile(r's.*_.*\.(png|jpe?g)', re.IGNORECASE)
-    for filename in os.listdir('./templates'):
-        if rePattern.fullmatch(filename):
-            tempImg = cv2.imread(f'./templates/{filename}')
-            if tempImg is not None:
-                swastikas_swas.append(tempImg)
+# The match processes of a run. The scheduler grows and shrinks it as the run goes
+class WorkerPool:
+    def __init__(self, queue, workerArgs, maxWorkers):
+        self.queue = queue
+        self.workerArgs = workerArgs # Everything queue_worker gets
+        self.maxWorkers = maxWorkers
+        self.processes = []
+        self.active = 0 # Processes that have not been told to stop
 
-                swasName = filename.split('_', 1)[1].replace('.png', '')
-                swastikas_name.append(swasName)
-                if longest_name < len(swasName):
-                    longest_name = len(swasName)
-            del tempImg
-    display_length = 16 + longest_name
+    def grow(self):
+        process = PROCESS_CONTEXT.Process(target=queue_worker, args=self.workerArgs)
+        process.start()
+        self.processes.append(process)
+        self.active += 1
 
-    batch_size = 4
+    # The poison goes behind the megachunks already queued, the first worker to get to it stops
+    def shrink(self):
+        self.queue.put(None)
+        self.active -= 1
+
+    def stop(self):
+        for _ in range(self.active):
+            self.queue.put(None)
+        self.active = 0
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+# Balances the fetch and match stages and returns the new number of megachunks fetched at once.
+# Fetched megachunks piling up in the queue mean matching is behind: a match process is added and a fetch given back.
+# An empty queue while every fetch is busy means fetching is behind: a fetch is added, and a match process is retired
+# when the processes and fetches are more than the cores. The slabs bound the megachunks in flight whatever the split.
+# The caller then resizes the decode thread pool to the cores the match processes leave (see decode_worker_count)
+def rebalance(pool, fetchLimit, maxFetch, backlog, fetchesBusy):
+    if backlog >= 2 and pool.active < pool.maxWorkers:
+        pool.grow()
+        return max(1, fetchLimit - 1)
+    if backlog == 0 and fetchesBusy and fetchLimit < maxFetch:
+        if pool.active > 1 and pool.active + fetchLimit >= (os.cpu_count() or 1):
+            pool.shrink()
+        return fetchLimit + 1
+    return fetchLimit
+
+# Threads the tiles are decoded in: the cores the match processes leave free, at least one
+def decode_worker_count(pool):
+    return max(1, (os.cpu_count() or 1) - pool.active)
+
+# Function to process the image in chunks
+# Fetches the units of every job (see ScanJob) into the queue, one job after the other, with the scheduler balancing
+# the fetches against the match processes of pool
+async def process_image_in_chunks(jobs, queue, slabs, free_slabs, fetcher, pool, cacheSize=0, fallbackDays=1, results_queue=None, dbPath=None, predecessors=None):
+    # Tiles are decoded against the LUT, so every color of the canvas palette has to be in it
+    for canvas_id in dict.fromkeys(job.canvas_id for job in jobs):
+        canvas = next(job.canvas for job in jobs if job.canvas_id == canvas_id)
+        for color in canvas['colors']:
+            if tuple(color[::-1]) not in SEARCHABLE_LUT:
+                print(f"WARNING: Color {tuple(color)} of canvas {canvas_id} is not in the palette, its pixels will not be matched")
 
-    print(f"{start_y}, {image_height}, {chunk_size}\n{start_x},{image_width},{chunk_size}")
-    
-    # Chunk dimensions: Calculate how many chunks we need based on the image dimensions
-    for y in range(start_y, image_height+start_y, chunk_size):
-        for x in range(start_x, image_width+start_y, chunk_size):
-            taskNumber += 1
-            # Calculate the current chunk's width and height
-            chunk_width = min(chunk_size, (image_width+start_y) - x)  # Avoid going beyond the image width
-            chunk_height = min(chunk_size, (image_height+start_y) - y)  # Avoid going beyond the image height
-
-            # Call the async get_area function for the current chunk
-            tasks.append(asyncio.create_task(semaphoreMegaChunkProcessor(canvas_id, canvas, x, y, chunk_width, chunk_height, start_date, taskNumber, searchable_colors_BGR, swastikas_swas, swastikas_name, display_length, batch_size, queue)))
-    
     fetch_timer_start = time.time()
-    processedChunks = 0
-    
-    await asyncio.gather(*tasks)
+    units = [unit for job in jobs for unit in job.units]
+    pending = list(reversed([(job, unit) for job in jobs for unit in job.units]))
+    inFlight = set()
+    fetchLimit = min(FETCH_CONCURRENCY, len(slabs))
+    fetched = 0
+    lastRebalance = time.monotonic()
+    predecessors = predecessors or {}
+    settled = set()
+    decodeWorkers = decode_worker_count(pool)
+    fetcher.decodePool = ThreadPoolExecutor(max_workers=decodeWorkers)
+    try:
+        async with fetcher:
+            while pending or inFlight:
+                if predecessors and pending:
+                    settled = settled_units(dbPath, [job.runId for job in jobs]) # A unit is only fetched once its previous date is matched
+                while pending and len(inFlight) < fetchLimit:
+                    ready = pop_ready_unit(pending, predecessors, settled)
+                    if ready is None:
+                        break
+                    job, unit = ready
+                    inFlight.add(asyncio.ensure_future(fetch_megachunk(fetcher, job.canvas_id, job.canvas, unit, job.date, queue, slabs, free_slabs, fallbackDays, results_queue, job.runId)))
+                if not inFlight:
+                    await asyncio.sleep(SWEEP_POLL_INTERVAL)
+                    continue
+                done, inFlight = await asyncio.wait(inFlight, timeout=SWEEP_POLL_INTERVAL if predecessors else REBALANCE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result() # A failed megachunk fails the run, like before
+                fetched += len(done)
+
+                if time.monotonic() - lastRebalance >= REBALANCE_INTERVAL:
+                    lastRebalance = time.monotonic()
+                    try:
+                        backlog = queue.qsize() # Fetched megachunks waiting for a match process
+                    except NotImplementedError: # macOS
+                        backlog = 0
+                    newLimit = rebalance(pool, fetchLimit, len(slabs), backlog, len(inFlight) >= fetchLimit)
+                    if decode_worker_count(pool) != decodeWorkers:
+                        # A new pool of the new size takes the next tiles, the old one finishes the ones it has
+                        decodeWorkers = decode_worker_count(pool)
+                        fetcher.decodePool.shutdown(wait=False)
+                        fetcher.decodePool = ThreadPoolExecutor(max_workers=decodeWorkers)
+                    if newLimit != fetchLimit:
+                        print(f"Scheduler: {pool.active} match processes, {newLimit} megachunk fetches, {decodeWorkers} decode threads ({fetched / (time.time() - fetch_timer_start) * 60:.1f} megachunks/min fetched, {backlog} waiting)")
+                    fetchLimit = newLimit
+    finally:
+        fetcher.decodePool.shutdown()
 
-    processedChunks = len(tasks)
-    
     fetch_timer_end = time.time()
     fetch_time = fetch_timer_end - fetch_timer_start
-    print(f"Loaded all {processedChunks} mega-chunks ({processedChunks*10*(chunk_size/256):.0f} chunks) into the queue in {(fetch_time / 60):.0f} minutes and {(fetch_time % 60):02.0f} seconds")
-            
-def queue_worker(queue):
+    loadedTiles = sum(unit_tile_count(unit, -(job.canvas['size'] // 2)) for job in jobs for unit in job.units)
+    print(f"Loaded all {len(units)} mega-chunks ({loadedTiles} chunks) into the queue in {(fetch_time / 60):.0f} minutes and {(fetch_time % 60):02.0f} seconds")
+
+    print(fetcher.metrics_summary())
+
+    if fetcher.cacheDir is not None:
+        evicted = tile_cache_evict(fetcher.cacheDir, cacheSize)
+        if evicted:
+            print(f"Evicted {evicted} tiles from the tile cache")
+
+# Imports the (x, y, w, h) region of a canvas on start_date into a snapshot file, with the tiles of source
+# (a TileFetcher for the backups, or a LocalTileSource). The file only gets its name once it is complete
+async def import_snapshot(path, canvas_id, canvas, x, y, w, h, start_date, source, fallbackDays=1):
+    bkg = background_index(canvas)
+    iter_date = start_date.strftime("%Y%m%d")
+    fetchDates = fallback_dates(start_date, fallbackDays)
+    offset = int(-canvas['size'] / 2)
+
+    partialPath = path + '.part'
+    canvasImage = create_snapshot(partialPath, w, h)
+    tileDates = {}
+    tileRows = range((y - offset) // 256, (y + h - 1 - offset) // 256 + 1)
+    tileColumns = range((x - offset) // 256, (x + w - 1 - offset) // 256 + 1)
+    async with source:
+        for rowNumber, iy in enumerate(tileRows):
+            tasks = []
+            for ix in tileColumns:
+                tasks.append(fetch_chunk(source, canvas_id, fetchDates, ix, iy, ix * 256 + offset - x, iy * 256 + offset - y, canvasImage, SEARCHABLE_LUT, bkg))
+            tileDates.update(zip((f"{ix},{iy}" for ix in tileColumns), await asyncio.gather(*tasks)))
+            if rowNumber % 16 == 15 or rowNumber == len(tileRows) - 1:
+                print(f"Imported {rowNumber + 1} of {len(tileRows)} tile rows")
+    print(source.metrics_summary())
+
+    header = {
+        'canvas_id': canvas_id,
+        'date': iter_date,
+        'x': x, 'y': y, 'width': w, 'height': h,
+        'canvasSize': canvas['size'],
+        'palette': canvas['colors'], # The colors of the canvas itself
+        'colors': SEARCHABLE_COLORS_RGB, # What the indices stand for
+        'tileDates': tileDates # Which date every tile came from (None if no date had it)
+    }
+    finish_snapshot(partialPath, canvasImage, header)
+    del canvasImage
+    os.replace(partialPath, path)
+
+# The results database holds every detection of every run, and the work ledger of every run: the state of each of
+# its work units (planned, fetched, written). It is in WAL mode, so it can be read while a run writes to it
+def open_results_db(dbPath):
+    connection = sqlite3.connect(dbPath, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, canvas TEXT, date TEXT, started REAL, finished REAL)")
+    connection.execute("""CREATE TABLE IF NOT EXISTS detections (
+        run INTEGER, canvas TEXT, x INTEGER, y INTEGER, color INTEGER, template TEXT, sourceDate TEXT, megachunk INTEGER,
+        mismatches INTEGER DEFAULT 0, conflicts INTEGER DEFAULT 0,
+        PRIMARY KEY (run, canvas, x, y, color, template))""")
+    columns = [column[1] for column in connection.execute("PRAGMA table_info(detections)")]
+    if 'mismatches' not in columns: # Databases from before the tolerant matching, every detection of theirs is exact
+        connection.execute("ALTER TABLE detections ADD COLUMN mismatches INTEGER DEFAULT 0")
+        connection.execute("ALTER TABLE detections ADD COLUMN conflicts INTEGER DEFAULT 0")
+    connection.execute("""CREATE TABLE IF NOT EXISTS units (
+        run INTEGER, number INTEGER, x INTEGER, y INTEGER, w INTEGER, h INTEGER, coreW INTEGER, coreH INTEGER, state TEXT,
+        PRIMARY KEY (run, number))""")
+    return connection
+
+# Adds a run and its planned work units to the results database and returns its id
+def start_results_run(dbPath, canvas_id, iter_date, units):
+    with open_results_db(dbPath) as connection:
+        runId = connection.execute("INSERT INTO runs (canvas, date, started) VALUES (?, ?, ?)", (canvas_id, iter_date, time.time())).lastrowid
+        connection.executemany("INSERT INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'planned')", [(runId,) + tuple(unit) for unit in units])
+    connection.close()
+    return runId
+
+# Finds the last run of a canvas (on iter_date if given) that did not write all of its work units.
+# Returns its id, its date and the units it has left, or (None, None, None)
+def find_unfinished_run(dbPath, canvas_id, iter_date=None):
+    connection = open_results_db(dbPath)
+    query = "SELECT id, date FROM runs WHERE canvas = ? AND finished IS NULL"
+    parameters = (canvas_id,)
+    if iter_date is not None:
+        query += " AND date = ?"
+        parameters += (iter_date,)
+    run = connection.execute(query + " ORDER BY id DESC LIMIT 1", parameters).fetchone()
+    if run is None:
+        connection.close()
+        return None, None, None
+    runId, runDate = run
+    rows = connection.execute("SELECT number, x, y, w, h, coreW, coreH FROM units WHERE run = ? AND state != 'written' ORDER BY number", (runId,)).fetchall()
+    connection.close()
+    return runId, runDate, [WorkUnit(*row) for row in rows]
+
+# The unit every unit of a sweep has to wait for: the same megachunk of its canvas on the previous date. Both would read
+# and write the same incremental state, which is only matched once per date when they run one after the other
+# (see match_templates_incremental). Returns {(run, unit number): (run, unit number)}
+def sweep_predecessors(jobs):
+    predecessors = {}
+    latest = {} # (canvas, x, y, w, h) -> the last (run, unit number) of it so far
+    for job in sorted(jobs, key=lambda job: job.date):
+        for unit in job.units:
+            key = (job.canvas_id, unit.x, unit.y, unit.w, unit.h)
+            if key in latest:
+                predecessors[(job.runId, unit.number)] = latest[key]
+            latest[key] = (job.runId, unit.number)
+    return predecessors
+
+# The (run, unit number) of the units of runIds that a worker is done with, written or failed
+def settled_units(dbPath, runIds):
+    connection = open_results_db(dbPath)
+    runList = ",".join(str(int(runId)) for runId in runIds)
+    settled = set(connection.execute(f"SELECT run, number FROM units WHERE run IN ({runList}) AND state IN ('written', 'failed')").fetchall())
+    connection.close()
+    return settled
+
+# Takes the first (job, unit) of pending (the last one of the list) whose predecessor (see sweep_predecessors) is
+# settled, None if every one of them still has to wait
+def pop_ready_unit(pending, predecessors, settled):
+    for position in range(len(pending) - 1, -1, -1):
+        job, unit = pending[position]
+        predecessor = predecessors.get((job.runId, unit.number))
+        if predecessor is None or predecessor in settled:
+            return pending.pop(position)
+    return None
+
+# The one result sink of a run (or of all the runs of a sweep): a process that owns the results database and writes what
+# the fetchers and workers send it, ('fetched', run, unit, None) and ('scanned', run, unit, detections). The detections
+# of a unit are committed together with its 'written' state, so a unit is either done for good or left for --resume.
+# A unit a worker failed on is marked 'failed' (('failed', run, unit, None)), it is left for --resume too.
+# Every batch (and whatever else is waiting) is committed right away, so a run can be followed with any SQLite client
+def results_collector(results_queue, dbPath, runIds, stats_queue=None):
+    connection = open_results_db(dbPath)
+    finished = False
+    writeSeconds = 0
+    batchCount = 0
+    while not finished:
+        messages = [results_queue.get()]
+        while True:
+            try:
+                messages.append(results_queue.get_nowait())
+            except Empty:
+                break
+        write_timer_start = time.perf_counter()
+        batchCount += 1
+        for message in messages:
+            if message is None: # Poison, the workers are done
+                finished = True
+                continue
+            kind, runId, unitNumber, records = message
+            if kind == 'fetched':
+                connection.execute("UPDATE units SET state = 'fetched' WHERE run = ? AND number = ? AND state = 'planned'", (runId, unitNumber))
+            elif kind == 'failed':
+                connection.execute("UPDATE units SET state = 'failed' WHERE run = ? AND number = ? AND state != 'written'", (runId, unitNumber))
+            else:
+                connection.executemany("INSERT OR IGNORE INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [(runId,) + record for record in records])
+                connection.execute("UPDATE units SET state = 'written' WHERE run = ? AND number = ?", (runId, unitNumber))
+        connection.commit()
+        writeSeconds += time.perf_counter() - write_timer_start
+    # A run is only finished once every unit is written, otherwise --resume picks it up
+    connection.executemany("UPDATE runs SET finished = ? WHERE id = ? AND NOT EXISTS (SELECT 1 FROM units WHERE run = ? AND state != 'written')", [(time.time(), runId, runId) for runId in runIds])
+    connection.commit()
+    connection.close()
+    if stats_queue is not None:
+        stats_queue.put({'collector': multiprocessing.current_process().name, 'writeSeconds': writeSeconds, 'commits': batchCount, 'peakRssMB': peak_rss_mb()})
+
+# Merges the last run of every shard results database into a new run of dbPath. A match found by two shards is
+# kept once. Returns the id of the merged run
+def merge_results(dbPath, shardPaths):
+    shardRuns = []
+    for shardPath in shardPaths:
+        if not os.path.exists(shardPath):
+            raise FileNotFoundError(f"There is no results database at {shardPath}")
+        connection = open_results_db(shardPath)
+        run = connection.execute("SELECT id, canvas, date, finished FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+        if run is None:
+            connection.close()
+            raise ValueError(f"{shardPath} has no runs")
+        shardRunId, canvas_id, iter_date, finished = run
+        units = connection.execute("SELECT number, x, y, w, h, coreW, coreH, state FROM units WHERE run = ?", (shardRunId,)).fetchall()
+        detections = connection.execute("SELECT canvas, x, y, color, template, sourceDate, megachunk, mismatches, conflicts FROM detections WHERE run = ?", (shardRunId,)).fetchall()
+        connection.close()
+        if finished is None:
+            print(f"WARNING: The run #{shardRunId} of {shardPath} is unfinished, resume it and merge again to get all of its detections")
+        shardRuns.append((canvas_id, iter_date, finished, units, detections))
+
+    if len({(canvas_id, iter_date) for canvas_id, iter_date, _, _, _ in shardRuns}) > 1:
+        raise ValueError("The shards are not scans of the same canvas on the same date")
+    canvas_id, iter_date = shardRuns[0][:2]
+    allFinished = all(finished is not None for _, _, finished, _, _ in shardRuns)
+    with open_results_db(dbPath) as connection:
+        runId = connection.execute("INSERT INTO runs (canvas, date, started, finished) VALUES (?, ?, ?, ?)", (canvas_id, iter_date, time.time(), time.time() if allFinished else None)).lastrowid
+        for _, _, _, units, detections in shardRuns:
+            connection.executemany("INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(runId,) + unit for unit in units])
+            connection.executemany("INSERT OR IGNORE INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [(runId,) + detection for detection in detections])
+    connection.close()
+    return runId
+
+# Writes the detections of a run as the text list (one link per line, matches on tiles that fell back to
+# an earlier backup say which one, and so do the ones that are not exact). Returns how many there are
+def export_results_text(dbPath, runId, path):
+    connection = open_results_db(dbPath)
+    iter_date, = connection.execute("SELECT date FROM runs WHERE id = ?", (runId,)).fetchone()
+    rows = connection.execute("SELECT canvas, x, y, color, template, sourceDate, mismatches, conflicts FROM detections WHERE run = ? ORDER BY megachunk, color, template, y, x", (runId,)).fetchall()
+    connection.close()
+    display_length = 16 + max((len(row[4]) for row in rows), default=0)
+    with open(path, "w") as swasList:
+        for canvas_id, X, Y, color, template, sourceDate, mismatches, conflicts in rows:
+            detectedName = f"{LUT_COLOR_NAMES[color]} {template}"
+            fallback = f" (from the {sourceDate} backup)" if sourceDate is not None and sourceDate != iter_date else ""
+            approximate = f" ({mismatches} symbol pixels off, {conflicts} stray pixels)" if mismatches or conflicts else ""
+            swasList.write(f"{detectedName:<{display_length}} - https://pixmap.fun/#{canvas_id},{X},{Y},36{fallback}{approximate}\n")
+    return len(rows)
+
+# Spatial index of the detections of a run. Detections whose template windows overlap are merged into one cluster, so a
+# symbol found by several templates, colors or neighbouring anchors is reviewed once. The clusters are kept in a grid of
+# CLUSTER_CELL_SIZE cells (every cell its box covers), so region and nearest queries only look at the cells around them.
+# templateSizes maps template names to their (height, width), detections of unknown templates get the largest size
+class DetectionIndex:
+    def __init__(self, detections, templateSizes):
+        largest = (max((th for th, _ in templateSizes.values()), default=1), max((tw for _, tw in templateSizes.values()), default=1))
+        boxes = []
+        for X, Y, color, template, mismatches, conflicts in detections:
+            th, tw = templateSizes.get(template, largest)
+            boxes.append((X, Y, X + tw, Y + th))
+
+        # Union-find over the detections whose boxes overlap, looked up in the grid
+        parent = list(range(len(boxes)))
+        def find(number):
+            while parent[number] != number:
+                parent[number] = parent[parent[number]]
+                number = parent[number]
+            return number
+        cells = collections.defaultdict(list)
+        for number, box in enumerate(boxes):
+            for cell in self.cells_of(*box):
+                for other in cells[cell]:
+                    if box_distance(box, boxes[other]) < 0:
+                        parent[find(other)] = find(number)
+                cells[cell].append(number)
+
+        groups = collections.defaultdict(list)
+        for number in range(len(boxes)):
+            groups[find(number)].append(number)
+        self.clusters = []
+        for numbers in groups.values():
+            hits = sorted(tuple(detections[number]) for number in numbers)
+            self.clusters.append(DetectionCluster(
+                min(boxes[number][0] for number in numbers), min(boxes[number][1] for number in numbers),
+                max(boxes[number][2] for number in numbers), max(boxes[number][3] for number in numbers),
+                hits, sorted({hit[3] for hit in hits}), sorted({hit[2] for hit in hits})))
+        self.clusters.sort(key=lambda cluster: (cluster.y0, cluster.x0))
+
+        self.grid = collections.defaultdict(list) # Cell -> numbers of the clusters whose box covers some of it
+        for number, cluster in enumerate(self.clusters):
+            for cell in self.cells_of(cluster.x0, cluster.y0, cluster.x1, cluster.y1):
+                self.grid[cell].append(number)
+        cells = list(self.grid) or [(0, 0)]
+        self.extent = (min(cellX for cellX, _ in cells), min(cellY for _, cellY in cells), max(cellX for cellX, _ in cells), max(cellY for _, cellY in cells))
+
+    @staticmethod
+    def cells_of(x0, y0, x1, y1):
+        for cellY in range(y0 // CLUSTER_CELL_SIZE, (y1 - 1) // CLUSTER_CELL_SIZE + 1):
+            for cellX in range(x0 // CLUSTER_CELL_SIZE, (x1 - 1) // CLUSTER_CELL_SIZE + 1):
+                yield cellX, cellY
+
+    # The clusters whose box has some pixel in the (x0, y0, x1, y1) region (x1 and y1 excluded)
+    def region(self, x0, y0, x1, y1):
+        if x1 <= x0 or y1 <= y0:
+            return []
+        numbers = set()
+        for cell in self.cells_of(x0, y0, x1, y1):
+            numbers.update(self.grid.get(cell, ()))
+        return [self.clusters[number] for number in sorted(numbers) if box_distance(self.clusters[number][:4], (x0, y0, x1, y1)) < 0]
+
+    # The count clusters nearest to the pixel (x, y) (by the distance to their box), nearest first. The grid is searched
+    # in rings of cells around it, until no cell left can hold a nearer cluster
+    def nearest(self, x, y, count=1):
+        if not self.clusters:
+            return []
+        cellX, cellY = x // CLUSTER_CELL_SIZE, y // CLUSTER_CELL_SIZE
+        minX, minY, maxX, maxY = self.extent
+        maxRing = max(cellX - minX, maxX - cellX, cellY - minY, maxY - cellY)
+        found = {}
+        for ring in range(maxRing + 1):
+            for otherY in range(cellY - ring, cellY + ring + 1):
+                step = 1 if otherY in (cellY - ring, cellY + ring) else 2 * ring # Inside rows only have their two ends in the ring
+                for otherX in range(cellX - ring, cellX + ring + 1, max(step, 1)):
+                    for number in self.grid.get((otherX, otherY), ()):
+                        if number not in found:
+                            found[number] = box_distance(self.clusters[number][:4], (x, y, x + 1, y + 1))
+            if len(found) < count and ring < maxRing:
+                continue
+            best = heapq.nsmallest(count, found.items(), key=lambda item: (item[1], item[0]))
+            # Every cell outside the ring is at least ring * CLUSTER_CELL_SIZE pixels away
+            if len(best) == count and best[-1][1] <= ring * CLUSTER_CELL_SIZE:
+                break
+        return [self.clusters[number] for number, _ in best]
+
+# Gap in pixels between two (x0, y0, x1, y1) boxes (x1 and y1 excluded): the larger of the gaps on both axes, so it is
+# negative when they overlap and 0 when they only touch
+def box_distance(box, other):
+    return max(max(box[0], other[0]) - min(box[2], other[2]), max(box[1], other[1]) - min(box[3], other[3]))
+
+# The (height, width) of every template, the variants included, for DetectionIndex
+def template_sizes(directory='./templates'):
+    return {template.name: template.foreground.shape for template in load_templates(directory, variants=True)}
+
+# Builds the DetectionIndex of a run from the results database. Returns its canvas, its date and the index
+def load_detection_index(dbPath, runId, templateSizes):
+    connection = open_results_db(dbPath)
+    canvas_id, iter_date = connection.execute("SELECT canvas, date FROM runs WHERE id = ?", (runId,)).fetchone()
+    detections = connection.execute("SELECT x, y, color, template, mismatches, conflicts FROM detections WHERE run = ?", (runId,)).fetchall()
+    connection.close()
+    return canvas_id, iter_date, DetectionIndex(detections, templateSizes)
+
+# One line describing a cluster, with the templates and colors it was found with and its link
+def describe_cluster(canvas_id, cluster):
+    name = f"{'/'.join(LUT_COLOR_NAMES[color] for color in cluster.colors)} {'/'.join(cluster.templates)}"
+    hits = f" ({len(cluster.hits)} hits over {cluster.x1 - cluster.x0}x{cluster.y1 - cluster.y0})" if len(cluster.hits) > 1 else ""
+    return f"{name} - https://pixmap.fun/#{canvas_id},{cluster.x0},{cluster.y0},36{hits}"
+
+# Writes the clusters of a run as the review list, one line per symbol instead of one per detection.
+# Returns the index and how many clusters there are
+def export_clusters_text(dbPath, runId, path, templateSizes):
+    canvas_id, _, index = load_detection_index(dbPath, runId, templateSizes)
+    with open(path, "w") as clusterList:
+        for cluster in index.clusters:
+            clusterList.write(describe_cluster(canvas_id, cluster) + "\n")
+    return index, len(index.clusters)
+
+# Reads the indexed pixels of the (x0, y0, x1, y1) canvas region (x1 and y1 excluded) from a snapshot, or from the
+# tiles of the tile cache (looked for on every date of fetchDates, decoded tiles are kept in `tiles`). Pixels that
+# neither has are UNKNOWN_COLOR_INDEX
+def read_canvas_region(x0, y0, x1, y1, snapshot=None, cacheDir=None, canvas_id=None, canvas_size=None, fetchDates=(), tiles=None):
+    region = np.full((y1 - y0, x1 - x0), UNKNOWN_COLOR_INDEX, dtype=np.uint8)
+    if snapshot is not None:
+        header, snapshotImage = snapshot
+        sx0, sy0 = max(x0, header['x']), max(y0, header['y'])
+        sx1, sy1 = min(x1, header['x'] + header['width']), min(y1, header['y'] + header['height'])
+        if sx0 < sx1 and sy0 < sy1:
+            region[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = snapshotImage[sy0 - header['y']:sy1 - header['y'], sx0 - header['x']:sx1 - header['x']]
+        return region
+
+    offset = int(-canvas_size / 2)
+    tiles = tiles if tiles is not None else {}
+    for ty in range((y0 - offset) // 256, (y1 - 1 - offset) // 256 + 1):
+        for tx in range((x0 - offset) // 256, (x1 - 1 - offset) // 256 + 1):
+            if (tx, ty) not in tiles:
+                tiles[(tx, ty)] = None
+                for iter_date in fetchDates:
+                    cached, data = tile_cache_get(cacheDir, canvas_id, iter_date, tx, ty)
+                    if cached and data is not None:
+                        tiles[(tx, ty)] = decode_tile_indexed(data, SEARCHABLE_LUT)
+                        break
+            if tiles[(tx, ty)] is not None:
+                tile, opaque = tiles[(tx, ty)]
+                paste_indexed(region, tile, tx * 256 + offset - x0, ty * 256 + offset - y0, opaque)
+    return region
+
+# Saves an evidence crop of every cluster (its box and EVIDENCE_MARGIN around it, scaled EVIDENCE_SCALE times and
+# outlined) as <canvas>_<date>_<x>_<y>.png in directory, cut from the source (the arguments of read_canvas_region)
+# instead of fetching the tiles again. An evidence.json next to them says what every crop shows. Returns how many were saved
+def export_evidence(directory, canvas_id, iter_date, clusters, source):
+    os.makedirs(directory, exist_ok=True)
+    palette_BGR = np.zeros((256, 3), dtype=np.uint8)
+    palette_BGR[:len(SEARCHABLE_COLORS_RGB)] = np.array(SEARCHABLE_COLORS_RGB, dtype=np.uint8)[:, ::-1]
+    palette_BGR[UNKNOWN_COLOR_INDEX] = (255, 0, 255) # Pixels the source does not have
+    source = dict(source, tiles={}) # The tiles decoded for one crop are kept for the others
+    manifestPath = os.path.join(directory, "evidence.json")
+    manifest = []
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as manifestFile:
+            manifest = json.load(manifestFile)
+    saved = 0
+    for cluster in clusters:
+        x0, y0, x1, y1 = cluster.x0 - EVIDENCE_MARGIN, cluster.y0 - EVIDENCE_MARGIN, cluster.x1 + EVIDENCE_MARGIN, cluster.y1 + EVIDENCE_MARGIN
+        region = read_canvas_region(x0, y0, x1, y1, **source)
+        if (region == UNKNOWN_COLOR_INDEX).all():
+            print(f"WARNING: No snapshot or cached tiles hold the cluster at ({cluster.x0}, {cluster.y0}), it has no evidence crop")
+            continue
+        crop = cv2.resize(palette_BGR[region], None, fx=EVIDENCE_SCALE, fy=EVIDENCE_SCALE, interpolation=cv2.INTER_NEAREST)
+        cv2.rectangle(crop, (EVIDENCE_MARGIN * EVIDENCE_SCALE - 2, EVIDENCE_MARGIN * EVIDENCE_SCALE - 2), ((x1 - x0 - EVIDENCE_MARGIN) * EVIDENCE_SCALE + 1, (y1 - y0 - EVIDENCE_MARGIN) * EVIDENCE_SCALE + 1), (255, 0, 255), 2)
+        filename = f"{canvas_id}_{iter_date}_{cluster.x0}_{cluster.y0}.png"
+        cv2.imwrite(os.path.join(directory, filename), crop)
+        manifest = [entry for entry in manifest if entry['file'] != filename]
+        manifest.append({'file': filename, 'canvas': canvas_id, 'date': iter_date, 'box': [cluster.x0, cluster.y0, cluster.x1, cluster.y1], 'hits': len(cluster.hits),
+                         'templates': cluster.templates, 'colors': [LUT_COLOR_NAMES[color] for color in cluster.colors], 'link': f"https://pixmap.fun/#{canvas_id},{cluster.x0},{cluster.y0},36"})
+        saved += 1
+    with open(manifestPath, "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=1)
+    return saved
+
+# Where the evidence crops of a run are cut from (the arguments of read_canvas_region): the snapshot it was scanned from,
+# else the snapshot of its canvas and date in --snapshot-dir, else the tile cache. None if there is none of them
+def evidence_source(args, canvas_id, canvas_size, iter_date):
+    path = args.snapshot if args.snapshot is not None else snapshot_path(args.snapshot_dir, canvas_id, iter_date)
+    if os.path.exists(path):
+        return {'snapshot': open_snapshot(path)}
+    if args.no_cache:
+        return None
+    start_date = datetime.datetime.strptime(iter_date, "%Y%m%d").date()
+    return {'cacheDir': args.cache_dir, 'canvas_id': canvas_id, 'canvas_size': canvas_size, 'fetchDates': fallback_dates(start_date, args.fallback_days)}
+
+# Saves the evidence crops of the clusters of a run in args.evidence, or says why it can not
+def export_run_evidence(args, canvas_id, canvas_size, iter_date, clusters):
+    source = evidence_source(args, canvas_id, canvas_size, iter_date)
+    if source is None:
+        print(f"There is no snapshot of canvas {canvas_id} on {iter_date} and the tile cache is off, no evidence crops were saved")
+        return
+    saved = export_evidence(args.evidence, canvas_id, iter_date, clusters, source)
+    print(f"Saved {saved} evidence crops to \"{args.evidence}\"")
+
+# Looks at the clusters of a finished run (--run, or the last one) without scanning: the ones in the --query region, the
+# ones nearest to --nearest, and the evidence crops of those (or of all of them) with --evidence
+def review_detections(args):
+    connection = open_results_db(args.results_db)
+    runId = args.run if args.run is not None else connection.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+    connection.close()
+    if runId is None:
+        print(f"There are no runs in \"{args.results_db}\" yet")
+        return
+    canvas_id, iter_date, index = load_detection_index(args.results_db, runId, template_sizes())
+    print(f"Run #{runId} of canvas {canvas_id} on {iter_date} has {len(index.clusters)} clusters")
+
+    clusters = index.clusters
+    if args.query is not None:
+        clusters = index.region(*args.query)
+        print(f"{len(clusters)} clusters in ({args.query[0]}, {args.query[1]}) to ({args.query[2] - 1}, {args.query[3] - 1}):")
+        for cluster in clusters:
+            print(describe_cluster(canvas_id, cluster))
+    if args.nearest is not None:
+        nearX, nearY, count = args.nearest
+        clusters = index.nearest(nearX, nearY, count)
+        print(f"The {len(clusters)} clusters nearest to ({nearX}, {nearY}):")
+        for cluster in clusters:
+            distance = max(box_distance(cluster[:4], (nearX, nearY, nearX + 1, nearY + 1)), 0)
+            print(f"{describe_cluster(canvas_id, cluster)} ({distance} px away)")
+
+    if args.evidence is not None:
+        canvas_size = None
+        if not os.path.exists(args.snapshot if args.snapshot is not None else snapshot_path(args.snapshot_dir, canvas_id, iter_date)):
+            canvas_size = fetchMe(args.api_url)['canvases'][canvas_id]['size'] # Only the tile cache needs it
+        export_run_evidence(args, canvas_id, canvas_size, iter_date, clusters)
+
+# Prints how many megachunks of the runs the ledger has written, and when the rest should be done, until stop is set
+def report_progress(dbPath, runIds, interval, stop):
+    connection = open_results_db(dbPath)
+    runList = ", ".join(str(int(runId)) for runId in runIds)
+    total, = connection.execute(f"SELECT COUNT(*) FROM units WHERE run IN ({runList})").fetchone()
+    startWritten = None
+    progress_timer_start = time.time()
+    while not stop.wait(interval):
+        written, = connection.execute(f"SELECT COUNT(*) FROM units WHERE run IN ({runList}) AND state = 'written'").fetchone()
+        if startWritten is None:
+            startWritten = written # A resumed run starts with some already written
+        elapsed = time.time() - progress_timer_start
+        done = written - startWritten
+        eta = f"{(elapsed / done * (total - written) / 60):.0f} minutes and {(elapsed / done * (total - written) % 60):02.0f} seconds" if done else "unknown"
+        print(f"Progress: {written}/{total} megachunks written ({100 * written / max(total, 1):.1f}%), ETA {eta}")
+    connection.close()
+
+# Sums the per-unit stage timings of the worker reports into the JSON profile of the runs of jobs and writes it to
+# profileDir (as run<id>.json, or sweep<first id>-<last id>.json for a sweep)
+def write_run_profile(profileDir, jobs, wallSeconds, maxWorkers, stats, workerReports, collectorReports, fetcher=None):
+    units = [unit for report in workerReports for unit in report['units']]
+    stages = collections.Counter()
+    for unit in units:
+        for stage in ('slabWait', 'fetch', 'decode', 'index', 'queueWait', 'prune', 'match', 'write'):
+            stages[stage] += unit.get(stage, 0)
+    stages['collectorWrite'] = sum(report['writeSeconds'] for report in collectorReports)
+    profile = {
+        'runs': [{'run': job.runId, 'canvas': job.canvas_id, 'date': job.date.strftime("%Y%m%d"), 'region': list(job.region)} for job in jobs],
+        'wallSeconds': round(wallSeconds, 3),
+        'maxWorkers': maxWorkers,
+        'stageSeconds': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        'megachunks': len(units),
+        'detections': sum(unit.get('detections', 0) for unit in units),
+        'tiles': sum(unit.get('tiles', 0) for unit in units),
+        'tilesFallenBack': sum(unit.get('tilesFallenBack', 0) for unit in units),
+        'tilesMissing': sum(unit.get('tilesMissing', 0) for unit in units),
+        'tiles404': sum(unit.get('tiles404', 0) for unit in units),
+        'tileBytes': sum(unit.get('tileBytes', 0) for unit in units),
+        'pruning': dict(stats),
+        'peakRssMB': {
+            'main': peak_rss_mb(),
+            'children': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource is not None else None,
+            **{report['worker']: report['peakRssMB'] for report in workerReports},
+            **{report['collector']: report['peakRssMB'] for report in collectorReports}
+        },
+        'workers': [{key: value for key, value in report.items() if key not in ('units', 'stats')} for report in workerReports],
+        'collector': collectorReports,
+        'units': units
+    }
+    if fetcher is not None:
+        profile['network'] = {
+            'bytesDownloaded': fetcher.bytesDownloaded,
+            'statusCounts': {str(status): count for status, count in fetcher.statusCounts.items()},
+            'retries': fetcher.retries,
+            'cacheHits': fetcher.cacheHits
+        }
+    os.makedirs(profileDir, exist_ok=True)
+    runIds = [job.runId for job in jobs]
+    path = os.path.join(profileDir, f"run{runIds[0]}.json" if len(runIds) == 1 else f"sweep{min(runIds)}-{max(runIds)}.json")
+    with open(path, "w") as profileFile:
+        json.dump(profile, profileFile, indent=1)
+    return path, profile
+
+# Compares the detections of the runs of jobs, date after date for every canvas. Returns one entry per run with its
+# detections and the ones that appeared and disappeared since the run of the date before (the first date has none)
+def sweep_deltas(dbPath, jobs):
+    connection = open_results_db(dbPath)
+    deltas = []
+    for canvas_id in dict.fromkeys(job.canvas_id for job in jobs):
+        previous = None
+        for job in sorted((job for job in jobs if job.canvas_id == canvas_id), key=lambda job: job.date):
+            current = set(connection.execute("SELECT x, y, color, template FROM detections WHERE run = ?", (job.runId,)).fetchall())
+            entry = {'canvas': canvas_id, 'date': job.date.strftime("%Y%m%d"), 'run': job.runId, 'detections': len(current)}
+            if previous is not None:
+                entry['appeared'] = [{'x': X, 'y': Y, 'color': LUT_COLOR_NAMES[color], 'template': template} for X, Y, color, template in sorted(current - previous)]
+                entry['disappeared'] = [{'x': X, 'y': Y, 'color': LUT_COLOR_NAMES[color], 'template': template} for X, Y, color, template in sorted(previous - current)]
+            deltas.append(entry)
+            previous = current
+    connection.close()
+    return deltas
+
+def queue_worker(queue, results_queue, free_slabs, variants=False, stateDir=None, prune=True, stats_queue=None, snapshotPath=None, tolerance=(0, 0)):
+    templates = load_templates(variants=variants) # Compiled once, when the worker starts
+    print(f"{multiprocessing.current_process().name} compiled {len(templates)} templates")
+    slabs = {} # Slabs this worker has attached to
+    snapshot = open_snapshot(snapshotPath) if snapshotPath is not None else None # Mapped once, the megachunks are views of it
+    stats = collections.Counter() # Run stats of this worker, sent to main() when it dies
+    profiles = [] # Run profile of every megachunk this worker scanned, sent along
+    busySeconds = 0
+    worker_timer_start = time.time()
     while True:
         try:
             queueTuple = queue.get()
@@ -331,23 +1822,223 @@ def queue_worker(queue):
                 break
             
             # Unpacks the tuple
-            taskNumber, searchable_colors_BGR, image, swastikas_swas, swastikas_name, display_length, canvas_id, x, y = queueTuple
+            runId, unit, slabName, canvas_id, canvas_size, iter_date, tileDates, profile = queueTuple
+            profile['queueWait'] = time.time() - profile.pop('queuedAt')
+            busy_timer_start = time.perf_counter()
+            try:
+                templates = load_templates(variants=variants) # Cache hit unless the template files changed
 
-            print(f"{multiprocessing.current_process().name} received mega chunk #{taskNumber}")
-            asyncio.run(image_processing(multiprocessing.current_process().name, taskNumber, searchable_colors_BGR, image, swastikas_swas, swastikas_name, display_length, canvas_id, x, y))
+                print(f"{multiprocessing.current_process().name} received mega chunk #{unit.number}")
+                if slabName is None: # Scanning a snapshot
+                    header, snapshotImage = snapshot
+                    canvasImage = snapshotImage[unit.y - header['y']:unit.y - header['y'] + unit.h, unit.x - header['x']:unit.x - header['x'] + unit.w]
+                    tileDates = header['tileDates']
+                else:
+                    canvasImage = slab_view(slabs, slabName, unit.h, unit.w)
+                image_processing(multiprocessing.current_process().name, unit.number, canvasImage, templates, results_queue, canvas_id, unit.x, unit.y, canvas_size, stateDir, iter_date, tileDates, (unit.coreH, unit.coreW), prune, stats, profile, tolerance, runId)
+                profiles.append(dict(profile, run=runId, unit=unit.number, x=unit.x, y=unit.y, worker=multiprocessing.current_process().name))
+            except:
+                results_queue.put(('failed', runId, unit.number, None)) # The units of the next dates waiting on it go on
+                raise
+            finally:
+                if slabName is not None:
+                    free_slabs.put(slabName) # Recycles the slab for the fetchers
+                busySeconds += time.perf_counter() - busy_timer_start
 
         except Exception as e:
             print(f"An error occured: {e}")
             traceback.print_exc()
+    for slab in slabs.values():
+        slab.close()
+    if stats_queue is not None:
+        stats_queue.put({
+            'worker': multiprocessing.current_process().name,
+            'stats': dict(stats),
+            'units': profiles,
+            'busySeconds': busySeconds,
+            'aliveSeconds': time.time() - worker_timer_start,
+            'peakRssMB': peak_rss_mb()
+        })
     print(f"Killed {multiprocessing.current_process().name}")
 
+# Turns a live chunk (the raw palette indices of a 256x256 tile, as <api>/chunks/<canvas>/<cx>/<cy>.bmp serves them)
+# into LUT indices, remap takes the palette indices to LUT indices. An empty chunk was never painted on
+def decode_live_chunk(data, remap, bkg):
+    if not data:
+        return np.full((256, 256), bkg, dtype=np.uint8)
+    indices = np.zeros(256 * 256, dtype=np.uint8) # Short chunks are padded with the first palette color
+    chunk = np.frombuffer(data, dtype=np.uint8)[:256 * 256]
+    indices[:chunk.size] = chunk & LIVE_CHUNK_BITMASK
+    return remap[indices].reshape(256, 256)
+
+# Polls every live chunk of the watched region with a conditional request (ETag and Last-Modified, plus a hash of the
+# chunk for servers that send neither) and decodes the changed ones into canvasImage. validators keeps what the
+# last poll saw of every chunk. Returns the (y0, y1, x0, x1) rectangles of canvasImage that changed
+async def poll_live_chunks(fetcher, liveUrl, canvas_id, chunks, canvasImage, remap, bkg, validators):
+    H, W = canvasImage.shape
+    async def poll(cx, cy, offx, offy):
+        etag, lastModified, digest = validators.get((cx, cy), (None, None, None))
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if lastModified is not None:
+            headers['If-Modified-Since'] = lastModified
+        try:
+            status, data, respHeaders = await fetcher.get(f"{liveUrl}/chunks/{canvas_id}/{cx}/{cy}.bmp", headers)
+        except TileFetchError as e:
+            print(f"WARNING: {e}, keeping what the last poll saw")
+            return None
+        if status == 304:
+            return None
+        data = data or b'' # A 404 is a chunk nobody painted on yet
+        newDigest = hashlib.sha1(data).hexdigest()
+        validators[(cx, cy)] = (respHeaders.get('ETag'), respHeaders.get('Last-Modified'), newDigest)
+        if newDigest == digest:
+            return None
+        paste_indexed(canvasImage, decode_live_chunk(data, remap, bkg), offx, offy)
+        return (max(offy, 0), min(offy + 256, H), max(offx, 0), min(offx + 256, W))
+
+    changed = await asyncio.gather(*(poll(*chunk) for chunk in chunks))
+    return [rectangle for rectangle in changed if rectangle is not None]
+
+# Keeps watching the live canvas: polls the chunks of the (x, y, w, h) region every args.watch_interval seconds,
+# re-matches the changed ones (and the halo of templates reaching into them) and emits the detections that appeared
+# or were removed, printed and as JSON lines appended to args.events. The region is held as one indexed image and the
+# detections as one dict, so the memory stays flat however long it runs
+async def watch_canvas(args, canvas_id, canvas, x, y, w, h):
+    templates = load_templates(variants=args.variants)
+    haloY = max((template.foreground.shape[0] for template in templates), default=1) - 1
+    haloX = max((template.foreground.shape[1] for template in templates), default=1) - 1
+    tolerance = (args.max_mismatches, args.max_conflicts)
+
+    bkg = background_index(canvas)
+    remap = np.full(256, UNKNOWN_COLOR_INDEX, dtype=np.uint8)
+    remap[:len(canvas['colors'])] = convert_to_indexed(np.array(canvas['colors'], dtype=np.uint8)[:, ::-1], SEARCHABLE_LUT)
+
+    offset = int(-canvas['size'] / 2)
+    chunks = [(cx, cy, cx * 256 + offset - x, cy * 256 + offset - y)
+              for cy in range((y - offset) // 256, (y + h - 1 - offset) // 256 + 1)
+              for cx in range((x - offset) // 256, (x + w - 1 - offset) // 256 + 1)]
+    canvasImage = np.full((h, w), bkg, dtype=np.uint8)
+    validators = {}
+    detections = {} # (color, templateNumber, y, x) -> (mismatches, conflicts), relative to the region
+
+    async with TileFetcher(args.storage_url, args.connections, rateLimit=args.rate_limit) as fetcher:
+        with open(args.events, "a") as events:
+            poll = 0
+            while args.watch_polls is None or poll < args.watch_polls:
+                poll += 1
+                poll_timer_start = time.time()
+                changed = await poll_live_chunks(fetcher, args.api_url, canvas_id, chunks, canvasImage, remap, bkg, validators)
+
+                found = {}
+                if poll == 1:
+                    # The whole region, one megachunk at a time like a scan
+                    regions = [(0, h, 0, w)]
+                    for unit in plan_work_units(0, 0, w, h, WATCH_UNIT_SIZE, haloX, haloY):
+                        view = canvasImage[unit.y:unit.y + unit.h, unit.x:unit.x + unit.w]
+                        for color, templateNumber, dy, dx, mismatches, conflicts in match_templates(view, templates, [(0, unit.coreH, 0, unit.coreW)], prescan_megachunk(view, templates), None, tolerance):
+                            found[(color, templateNumber, dy + unit.y, dx + unit.x)] = (mismatches, conflicts)
+                else:
+                    # The anchors whose template window reaches into a changed chunk
+                    regions = [(max(y0 - haloY, 0), y1, max(x0 - haloX, 0), x1) for y0, y1, x0, x1 in changed]
+                    for color, templateNumber, dy, dx, mismatches, conflicts in match_templates(canvasImage, templates, regions, None, None, tolerance):
+                        found[(color, templateNumber, dy, dx)] = (mismatches, conflicts)
+
+                stale = [key for key in detections if any(y0 <= key[2] < y1 and x0 <= key[3] < x1 for y0, y1, x0, x1 in regions)]
+                removed = [key for key in stale if key not in found]
+                appeared = [key for key in found if key not in detections]
+                for key in stale:
+                    detections.pop(key)
+                detections.update(found)
+
+                eventTime = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+                for kind, keys, counts in (('removed', removed, None), ('appeared', appeared, found)):
+                    for color, templateNumber, dy, dx in sorted(keys):
+                        X, Y = dx + x, dy + y
+                        mismatches, conflicts = counts[(color, templateNumber, dy, dx)] if counts is not None else (None, None)
+                        link = f"https://pixmap.fun/#{canvas_id},{X},{Y},36"
+                        events.write(json.dumps({'time': eventTime, 'event': kind, 'canvas': canvas_id, 'x': X, 'y': Y, 'color': LUT_COLOR_NAMES[color], 'template': templates[templateNumber].name, 'mismatches': mismatches, 'conflicts': conflicts, 'link': link}) + "\n")
+                        print(f"{'NEW ' if kind == 'appeared' else 'GONE'} {LUT_COLOR_NAMES[color]} {templates[templateNumber].name} - {link}")
+                events.flush()
+                print(f"Poll #{poll}: {len(changed)} of {len(chunks)} chunks changed, {len(appeared)} detections appeared and {len(removed)} were removed ({len(detections)} on the canvas) in {time.time() - poll_timer_start:.1f} seconds")
+
+                if args.watch_polls is None or poll < args.watch_polls:
+                    await asyncio.sleep(max(0, args.watch_interval - (time.time() - poll_timer_start)))
+        print(fetcher.metrics_summary())
+
 def main():
-    apime = fetchMe()
+    parser = argparse.ArgumentParser(description="Find all perfect swastikas across the canvas")
+    parser.add_argument('canvasID', nargs='*', help="ID of the canvas to scan, or of every canvas of a sweep (leave it out to list them)")
+    parser.add_argument('--dates', type=date_range, metavar='FROM:TO', help="scan the backups of every date from FROM to TO (YYYYMMDD) instead of today's, in one sweep")
+    parser.add_argument('--deltas', default='./sweepDeltas.json', help="where a sweep saves the detections that appeared and disappeared from one date to the next (default: ./sweepDeltas.json)")
+    parser.add_argument('--variants', action='store_true', help="also match the rotated and mirrored variants of every template")
+    parser.add_argument('--cache-dir', default='./tileCache', help="directory of the local tile cache (default: ./tileCache)")
+    parser.add_argument('--cache-size', type=int, default=2048, help="size cap of the tile cache in MB (default: 2048)")
+    parser.add_argument('--no-cache', action='store_true', help="always download the tiles")
+    parser.add_argument('--api-url', default=PPFUN_URL, help=f"where the canvas list (and the live chunks of --watch) are fetched from (default: {PPFUN_URL})")
+    parser.add_argument('--storage-url', default=PPFUN_STORAGE_URL, help=f"where the backup tiles are downloaded from (default: {PPFUN_STORAGE_URL})")
+    parser.add_argument('--connections', type=int, default=16, help="size of the connection pool (default: 16)")
+    parser.add_argument('--rate-limit', type=float, default=TILE_RATE_LIMIT, help=f"tile requests per second per host, 0 for no cap (default: {TILE_RATE_LIMIT})")
+    parser.add_argument('--fallback-days', type=int, default=1, help="how many days back a missing tile is looked for (default: 1)")
+    parser.add_argument('--workers', type=int, help="most match processes at once (default: one per core), the scheduler picks how many run")
+    parser.add_argument('--memory-budget', type=int, default=1024, help="memory in MB for the megachunks in flight, picks the megachunk size and how many are in flight (default: 1024)")
+    parser.add_argument('--no-prune', action='store_true', help="match every color everywhere, without the color histogram pre-scan")
+    parser.add_argument('--max-mismatches', type=int, default=0, metavar='K', help="also report symbols with up to K pixels of another color (griefed), below half of the symbol (default: 0)")
+    parser.add_argument('--max-conflicts', type=int, default=0, metavar='M', help="also report symbols with up to M background pixels of their color (stray neighbours), below half of the background (default: 0)")
+    parser.add_argument('--incremental', action='store_true', help="only re-match the tiles that changed since the previous scan")
+    parser.add_argument('--state-dir', default='./scanState', help="where --incremental keeps the tile hashes and detections (default: ./scanState)")
+    parser.add_argument('--results-db', default='./results.sqlite', help="SQLite database the detections of every run are written to (default: ./results.sqlite)")
+    parser.add_argument('--resume', action='store_true', help="go on with the last unfinished run of the canvas instead of starting over")
+    parser.add_argument('--shard', type=shard_spec, help="only scan shard i of N (e.g. 2/4) of the megachunks, to spread a scan over N machines")
+    parser.add_argument('--merge', nargs='+', metavar='DB', help="merge the last runs of these shard results databases into --results-db and export the list")
+    parser.add_argument('--profile-dir', default='./profiles', help="where the JSON profile of every run is written (default: ./profiles)")
+    parser.add_argument('--progress', type=float, metavar='SECONDS', help="print the progress and ETA every SECONDS seconds")
+    parser.add_argument('--watch', action='store_true', help="keep polling the live canvas and report the detections that appear or are removed")
+    parser.add_argument('--watch-interval', type=float, default=60, metavar='SECONDS', help="seconds between two polls of --watch (default: 60)")
+    parser.add_argument('--watch-polls', type=int, metavar='N', help="stop --watch after N polls (default: never)")
+    parser.add_argument('--events', default='./watchEvents.jsonl', help="file the --watch events are appended to as JSON lines (default: ./watchEvents.jsonl)")
+    parser.add_argument('--import-snapshot', action='store_true', help="only save the region as a snapshot file (in --snapshot-dir) for offline scans")
+    parser.add_argument('--tiles-dir', help="with --import-snapshot, read the tiles from this directory (<tx>/<ty>.png) instead of the backups")
+    parser.add_argument('--snapshot-dir', default='./snapshots', help="where --import-snapshot saves the snapshots (default: ./snapshots)")
+    parser.add_argument('--snapshot', help="scan this snapshot file instead of fetching tiles (no network, canvasID is not needed)")
+    parser.add_argument('--evidence', metavar='DIR', help="save a PNG crop of every detection cluster to DIR, cut from the snapshot or the tile cache (without a canvasID, of the clusters of --run)")
+    parser.add_argument('--run', type=int, metavar='ID', help="run of the results database that --query, --nearest and --evidence look at without a scan (default: the last one)")
+    parser.add_argument('--query', type=box_spec, metavar='X0,Y0,X1,Y1', help="list the detection clusters of --run in this region (X1 and Y1 excluded)")
+    parser.add_argument('--nearest', type=nearest_spec, metavar='X,Y[,K]', help="list the K (default: 1) detection clusters of --run nearest to (X, Y)")
+    args = parser.parse_args()
+
+    if args.merge is not None:
+        runId = merge_results(args.results_db, args.merge)
+        detectionCount = export_results_text(args.results_db, runId, "swastikaList.txt")
+        clusterCount = export_clusters_text(args.results_db, runId, "swastikaClusters.txt", template_sizes())[1]
+        print(f"Merged {len(args.merge)} shards into run #{runId} of \"{args.results_db}\", all {detectionCount} swastikas have been saved to \"swastikaList.txt\", the {clusterCount} symbols they are to \"swastikaClusters.txt\"")
+        return
+
+    if args.query is not None or args.nearest is not None or (args.evidence is not None and not args.canvasID and args.snapshot is None):
+        review_detections(args)
+        return
+
+    if args.snapshot is not None:
+        header = open_snapshot(args.snapshot)[0]
+        canvas_id = header['canvas_id']
+        canvas = {'size': header['canvasSize'], 'colors': header['palette']}
+        x, y, w, h = header['x'], header['y'], header['width'], header['height']
+        start_date = datetime.datetime.strptime(header['date'], "%Y%m%d").date()
+        scan(args, [(canvas_id, canvas, x, y, w, h, start_date)])
+        return
+
+    apime = fetchMe(args.api_url)
 
-    if len(sys.argv) != 2 and len(sys.argv) != 2:
+    if not args.canvasID:
         print("Find all perfect swastikas across the canvas")
         print("")
-        print("Usage:    naziFinder.py canvasID")
+        print("Usage:    naziFinder.py [--variants] [--cache-dir DIR] [--cache-size MB] [--no-cache] [--no-prune] [--max-mismatches K] [--max-conflicts M] [--incremental] [--resume] [--shard i/N] [--evidence DIR] [--import-snapshot] canvasID")
+        print("          naziFinder.py [--variants] [--no-prune] [--max-mismatches K] [--max-conflicts M] [--incremental] [--shard i/N] [--evidence DIR] --snapshot FILE")
+        print("          naziFinder.py [--variants] [--max-mismatches K] [--max-conflicts M] [--deltas FILE] [--dates FROM:TO] canvasID [canvasID ...]")
+        print("          naziFinder.py [--variants] [--max-mismatches K] [--max-conflicts M] [--watch-interval SECONDS] [--events FILE] --watch canvasID")
+        print("          naziFinder.py [--results-db DB] --merge SHARD_DB [SHARD_DB ...]")
+        print("          naziFinder.py [--run ID] [--query X0,Y0,X1,Y1] [--nearest X,Y[,K]] [--evidence DIR]")
         print("")
         print("→Canvas is last obtainable history canvas. This is NOT the current canvas but close enough")
         print("→images will be saved into canvas folder")
@@ -361,25 +2052,97 @@ def main():
         print("The coords will be output in terminal")
         return
 
-    canvas_id = sys.argv[1]
-
-    if canvas_id not in apime['canvases']:
-        print("Invalid canvas selected")
-        return
-
-    canvas = apime['canvases'][canvas_id]
+    for canvas_id in args.canvasID:
+        if canvas_id not in apime['canvases']:
+            print(f"Invalid canvas {canvas_id} selected")
+            return
 
-    if 'v' in canvas and canvas['v']:
-        print("Can\'t get area for 3D canvas")
-        return
+        if 'v' in apime['canvases'][canvas_id] and apime['canvases'][canvas_id]['v']:
+            print(f"Can\'t get area for 3D canvas {canvas_id}")
+            return
 
     start = [30000, 30000] # Hard coded to full canvas
     end = [40000, 40000] # Hard coded to full canvas
-    start_date = datetime.date.today()
+    dates = args.dates if args.dates is not None else [datetime.date.today()]
     x = int(start[0])
     y = int(start[1])
     w = int(end[0]) - x + 1
     h = int( end[1]) - y + 1
+
+    if (args.watch or args.import_snapshot) and len(args.canvasID) > 1:
+        print("--watch and --import-snapshot take a single canvas")
+        return
+    canvas_id = args.canvasID[0]
+    canvas = apime['canvases'][canvas_id]
+
+    if args.watch:
+        print(f"Watching ({x}, {y}) to ({x + w - 1}, {y + h - 1}) on the live canvas every {args.watch_interval:g} seconds, the events are appended to \"{args.events}\"")
+        try:
+            asyncio.run(watch_canvas(args, canvas_id, canvas, x, y, w, h))
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        return
+
+    if args.import_snapshot:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+        for start_date in dates:
+            path = snapshot_path(args.snapshot_dir, canvas_id, start_date.strftime("%Y%m%d"))
+            if args.tiles_dir is not None:
+                source, fallbackDays = LocalTileSource(args.tiles_dir), 0 # A directory holds a single day
+            else:
+                source, fallbackDays = TileFetcher(args.storage_url, args.connections, rateLimit=args.rate_limit, cacheDir=None if args.no_cache else args.cache_dir), args.fallback_days
+            print(f"Importing ({x}, {y}) to ({x + w - 1}, {y + h - 1}) into \"{path}\"...")
+            asyncio.run(import_snapshot(path, canvas_id, canvas, x, y, w, h, start_date, source, fallbackDays))
+            print(f"Saved the snapshot, scan it with --snapshot {path}")
+        return
+
+    scan(args, [(canvas_id, apime['canvases'][canvas_id], x, y, w, h, start_date) for canvas_id in args.canvasID for start_date in dates])
+
+# Plans the scan of the (x, y, w, h) region of a canvas on start_date, or picks up its unfinished run with --resume
+# (a run of a sweep or a snapshot only resumes the run of its own date). Returns its ScanJob
+def plan_scan_job(args, canvas_id, canvas, x, y, w, h, start_date, maxWorkers, slabCount, sameDate=False):
+    # A resumed run goes on with the units its ledger has not written yet, on the date it started with
+    if args.resume:
+        runId, runDate, units = find_unfinished_run(args.results_db, canvas_id, start_date.strftime("%Y%m%d") if sameDate else None)
+        if runId is None:
+            print(f"There is no unfinished run of canvas {canvas_id} to resume, starting a new one")
+        else:
+            print(f"Resuming run #{runId} of {runDate}, {len(units)} megachunks are left")
+            return ScanJob(runId, canvas_id, canvas, datetime.datetime.strptime(runDate, "%Y%m%d").date(), (x, y, w, h), units)
+
+    # The region is clipped to the canvas, a unit outside of it would never be fetched nor written
+    half = canvas['size'] // 2
+    clippedX, clippedY = max(x, -half), max(y, -half)
+    w, h = max(min(x + w, half) - clippedX, 0), max(min(y + h, half) - clippedY, 0)
+    x, y = clippedX, clippedY
+    if w == 0 or h == 0:
+        print(f"WARNING: The region is outside of canvas {canvas_id} ({canvas['size']}x{canvas['size']}), there is nothing to scan")
+
+    # Plans the work units. Their halo is the largest template size minus one, so symbols across unit borders are found
+    templates = load_templates(variants=args.variants)
+    haloY = max((template.foreground.shape[0] for template in templates), default=1) - 1
+    haloX = max((template.foreground.shape[1] for template in templates), default=1) - 1
+    if args.shard is not None:
+        unitSize = SHARD_UNIT_SIZE
+    else:
+        unitSize = choose_unit_size(x, y, w, h, maxWorkers, slabCount, args.memory_budget * 1024 * 1024, haloX, haloY, -half)
+    units = plan_work_units(x, y, w, h, unitSize, haloX, haloY, -half)
+    if args.shard is not None:
+        # Every node plans the same units and splits them the same way, then keeps its own share
+        shardIndex, shardCount = args.shard
+        costs = estimate_unit_costs(units, open_snapshot(args.snapshot) if args.snapshot is not None else None)
+        shards, loads = partition_units(units, costs, shardCount)
+        print(f"Shard {shardIndex}/{shardCount} has {len(shards[shardIndex - 1])} of the {len(units)} megachunks, with {loads[shardIndex - 1]} of the {sum(loads)} expected cost")
+        units = shards[shardIndex - 1]
+    runId = start_results_run(args.results_db, canvas_id, start_date.strftime("%Y%m%d"), units)
+    print(f"Run #{runId} scans ({x}, {y}) to ({x + w - 1}, {y + h - 1}) of canvas {canvas_id} on {start_date.strftime('%Y%m%d')} in {len(units)} megachunks of {unitSize}x{unitSize}")
+    return ScanJob(runId, canvas_id, canvas, start_date, (x, y, w, h), units)
+
+# Scans every (canvas_id, canvas, x, y, w, h, start_date) target, from the backups of its date or from the snapshot of
+# args.snapshot. All of them go through one results collector, one worker pool and one fetcher, the targets of a sweep
+# (several canvases or dates) one date after the other, so every megachunk is matched against the previous date's
+# (see match_templates_incremental) and the tiles that did not change are not matched again
+def scan(args, targets):
     if not os.path.exists('./templates'):
         os.mkdir('./templates')
 
@@ -387,46 +2150,121 @@ def main():
 
     #clear_screen()
     print("-----     THIS MIGHT TAKE A WHILE     -----\n       Wait for the \"Done!\" message")
+    slabs = {}
+    queue, pool, results_queue = None, None, None # Planning the jobs can fail before they exist
     try:
 
-        workerNumber = int(os.cpu_count()/2)
+        maxWorkers = args.workers or os.cpu_count() or 1
+        slabCount = 0 if args.snapshot is not None else maxWorkers + FETCH_CONCURRENCY # Snapshot megachunks are views of the file
+        sweep = len(targets) > 1
+        jobs = [plan_scan_job(args, *target, maxWorkers, slabCount, sweep or args.snapshot is not None) for target in targets]
+        jobs.sort(key=lambda job: job.date)
+        runIds = [job.runId for job in jobs]
+        units = [unit for job in jobs for unit in job.units]
 
-        # Clears the lists
-        with open("swastikaList.txt", 'w') as file:
-            pass
-        for workerNum in range(workerNumber):
-            with open(f"swastikaList{workerNum+1}.txt", 'w') as file:
-                pass
-    
-        queue = multiprocessing.Queue(maxsize=workerNumber)
+        # Every detection goes to the results collector, which writes it to the results database as it comes
+        results_queue = PROCESS_CONTEXT.Queue()
+        stats_queue = PROCESS_CONTEXT.Queue() # Every worker and the collector send their run profile here when they die
+        collector = PROCESS_CONTEXT.Process(target=results_collector, args=(results_queue, args.results_db, runIds, stats_queue))
+        collector.start()
+        print(f"The detections are written to \"{args.results_db}\" as they are found")
+
+        # Megachunks are decoded into shared memory slabs, the queue only carries their handles.
+        # The slabs are what bounds the megachunks in flight (fetching, queued or being matched) to the memory budget
+        slabSize = max((unit.w * unit.h for unit in units), default=1)
+        if slabCount:
+            slabCount = max(2, min(slabCount, args.memory_budget * 1024 * 1024 // slabSize))
+        slabs, free_slabs = create_slab_pool(slabCount, slabSize)
+        queue = PROCESS_CONTEXT.Queue()
+
+        # The match processes. A snapshot scan has nothing to fetch, so it gets all of them,
+        # a live scan starts with half of them and the scheduler moves cores between fetching and matching
+        pool = WorkerPool(queue, (queue, results_queue, free_slabs, args.variants, args.state_dir if args.incremental or sweep else None, not args.no_prune, stats_queue, args.snapshot, (args.max_mismatches, args.max_conflicts)), maxWorkers)
+        for _ in range(maxWorkers if args.snapshot is not None else max(1, maxWorkers // 2)):
+            pool.grow()
 
-        # Create 4 worker processes
-        workers = []
-        for _ in range(workerNumber):
-            process = multiprocessing.Process(target=queue_worker, args=(queue,))
-            process.start()
-            workers.append(process)
+        progressStop = None
+        if args.progress:
+            progressStop = threading.Event()
+            threading.Thread(target=report_progress, args=(args.results_db, runIds, args.progress, progressStop), daemon=True).start()
 
-        # Fetch chunks and fill queue
-        asyncio.run(process_image_in_chunks(canvas_id, canvas, x, y, w, h, start_date, 2560, queue))
+        # The megachunks of a sweep are matched one date after the other, the workers share their incremental state
+        predecessors = sweep_predecessors(jobs) if args.incremental or sweep else {}
+        fetcher = None
+        if args.snapshot is not None:
+            # Nothing to fetch, the workers map the snapshot themselves
+            pending = list(reversed([(job, unit) for job in jobs for unit in job.units]))
+            settled = set()
+            while pending:
+                ready = pop_ready_unit(pending, predecessors, settled)
+                if ready is None:
+                    time.sleep(SWEEP_POLL_INTERVAL)
+                    settled = settled_units(args.results_db, runIds)
+                    continue
+                job, unit = ready
+                queue.put((job.runId, unit, None, job.canvas_id, job.canvas["size"], job.date.strftime("%Y%m%d"), None, {'queuedAt': time.time()}))
+        else:
+            # Fetch chunks and fill queue
+            fetcher = TileFetcher(args.storage_url, args.connections, rateLimit=args.rate_limit, cacheDir=None if args.no_cache else args.cache_dir)
+            asyncio.run(process_image_in_chunks(jobs, queue, slabs, free_slabs, fetcher, pool, args.cache_size * 1024 * 1024, args.fallback_days, results_queue, args.results_db, predecessors))
         
         # Signal the workers to stop
         print("Poisoning the queue...")
-        for _ in range(workerNumber):
-            queue.put(None)
+        pool.stop()
 
         # Wait for all the processes to finish
         print("Waiting for Processes to die... \n(This is normal. Processes take longer than megachunk loaders)\n")
-        for worker in workers:
-            worker.join()
-
-        with open("swastikaList.txt", "w") as swasListAll:
-            for workerNum in range(workerNumber):
-                if os.path.exists(f'./swastikaList{workerNum+1}.txt'):
-                    with open(f'./swastikaList{workerNum+1}.txt', 'r') as swasList:
-                        swasListAll.write(swasList.read())
-        #clear_screen()
-        print("All swastikas have been saved to \"swastikaList.txt\"")
+        pool.join()
+        results_queue.put(None)
+        collector.join()
+        if progressStop is not None:
+            progressStop.set()
+
+        # Every worker and the collector have sent their report by now
+        stats = collections.Counter()
+        workerReports, collectorReports = [], []
+        while True:
+            try:
+                report = stats_queue.get(timeout=1)
+            except Empty:
+                break
+            if 'worker' in report:
+                stats.update(report['stats'])
+                workerReports.append(report)
+            else:
+                collectorReports.append(report)
+        if stats['combinations']:
+            print(f"Pruned {stats['prunedCombinations']} of {stats['combinations']} (color, template, block) combinations ({100 * stats['prunedCombinations'] / stats['combinations']:.1f}%), {stats['emptyMegachunks']} megachunks were one color")
+        if stats['tilesCarried']:
+            print(f"Matched {stats['tilesMatched']} of {stats['tilesMatched'] + stats['tilesCarried']} tiles, the others had not changed since their last scan")
+        profilePath, profile = write_run_profile(args.profile_dir, jobs, time.time() - total_timer_start, maxWorkers, stats, workerReports, collectorReports, fetcher)
+        stageSeconds = profile['stageSeconds']
+        print(f"Stage totals: " + ", ".join(f"{stage} {seconds:.1f} s" for stage, seconds in stageSeconds.items()) + f", the run profile has been saved to \"{profilePath}\"")
+        templateSizes = template_sizes()
+        if not sweep:
+            detectionCount = export_results_text(args.results_db, runIds[0], "swastikaList.txt")
+            index, clusterCount = export_clusters_text(args.results_db, runIds[0], "swastikaClusters.txt", templateSizes)
+            #clear_screen()
+            print(f"All {detectionCount} swastikas have been saved to \"swastikaList.txt\", the {clusterCount} symbols they are to \"swastikaClusters.txt\"")
+            if args.evidence is not None:
+                export_run_evidence(args, jobs[0].canvas_id, jobs[0].canvas["size"], jobs[0].date.strftime("%Y%m%d"), index.clusters)
+        else:
+            # One list per canvas and date, and what changed from one date to the next
+            for job in jobs:
+                listPath = f"swastikaList_{job.canvas_id}_{job.date.strftime('%Y%m%d')}.txt"
+                clusterPath = f"swastikaClusters_{job.canvas_id}_{job.date.strftime('%Y%m%d')}.txt"
+                detectionCount = export_results_text(args.results_db, job.runId, listPath)
+                index, clusterCount = export_clusters_text(args.results_db, job.runId, clusterPath, templateSizes)
+                print(f"All {detectionCount} swastikas of canvas {job.canvas_id} on {job.date.strftime('%Y%m%d')} have been saved to \"{listPath}\", the {clusterCount} symbols they are to \"{clusterPath}\"")
+                if args.evidence is not None:
+                    export_run_evidence(args, job.canvas_id, job.canvas["size"], job.date.strftime("%Y%m%d"), index.clusters)
+            deltas = sweep_deltas(args.results_db, jobs)
+            for delta in deltas:
+                if 'appeared' in delta:
+                    print(f"Canvas {delta['canvas']} on {delta['date']}: {delta['detections']} swastikas, {len(delta['appeared'])} appeared and {len(delta['disappeared'])} disappeared since the day before")
+            with open(args.deltas, "w") as deltasFile:
+                json.dump(deltas, deltasFile, indent=1)
+            print(f"The detection deltas of every date have been saved to \"{args.deltas}\"")
         
         total_timer_end = time.time()
         total_time = total_timer_end - total_timer_start
@@ -443,13 +2281,18 @@ def main():
 
         # Signal the workers to stop
         # Empties the queue
-        print("Emptying the queue...")
-        while not queue.empty():
-            queue.get()
+        if queue is not None:
+            print("Emptying the queue...")
+            while not queue.empty():
+                queue.get()
         # Poisons the workers
-        print("Poisoning the queue...")
-        for _ in range(workerNumber):
-            queue.put(None)
+        if pool is not None:
+            print("Poisoning the queue...")
+            pool.stop()
+        if results_queue is not None:
+            results_queue.put(None) # The collector commits what it has got and stops
+    finally:
+        destroy_slab_pool(slabs)
 
 
 if __name__ == "__main__":